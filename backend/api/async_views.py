@@ -0,0 +1,103 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.urls import URLPattern
+from rest_framework.response import Response
+
+
+class AsyncReadMixin:
+    """Async-версии list и retrieve на async ORM.
+
+    Queryset и фильтры строятся теми же методами, что и в синхронных
+    действиях; фильтрация (может проверять значения по базе) выполняется
+    в потоке ORM. Сериализаторы получают объекты с уже подгруженными
+    связями и в базу не ходят.
+    """
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await sync_to_async(self.filter_queryset)(
+            self.get_queryset())
+        if self.paginator is None:
+            objects = [obj async for obj in queryset]
+            return Response(self.get_serializer(objects, many=True).data)
+        page = await self.paginator.apaginate_queryset(
+            queryset, request, view=self)
+        return self.get_paginated_response(
+            self.get_serializer(page, many=True).data)
+
+    async def aget_object(self):
+        """get_object на async ORM: те же фильтры, 404 на значении из URL,
+        которое не приводится к типу поля, и проверка прав на объект."""
+        queryset = await sync_to_async(self.filter_queryset)(
+            self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = await queryset.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}).afirst()
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        if instance is None:
+            raise Http404
+        await sync_to_async(self.check_object_permissions)(
+            self.request, instance)
+        return instance
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.get_serializer(instance).data)
+
+
+def as_async_view(viewset, actions, **initkwargs):
+    """Async-представление для роута viewset.
+
+    Действия, у которых есть async-версия a<action>, выполняются в
+    цикле событий; аутентификация, права и троттлинг - одним переходом
+    в поток ORM. Остальные действия уходят в синхронное представление.
+    """
+    sync_view = sync_to_async(viewset.as_view(actions, **initkwargs))
+    actions = dict(actions)
+    if 'get' in actions and 'head' not in actions:
+        actions['head'] = actions['get']
+
+    async def view(request, *args, **kwargs):
+        action = actions.get(request.method.lower())
+        handler = getattr(viewset, f'a{action}', None)
+        if handler is None:
+            return await sync_view(request, *args, **kwargs)
+        self = viewset(**initkwargs)
+        self.action_map = actions
+        self.action = action
+        self.args, self.kwargs = args, kwargs
+        self.headers = self.default_response_headers
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await handler(self, request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        return self.finalize_response(request, response, *args, **kwargs)
+
+    view.cls = viewset
+    view.initkwargs = initkwargs
+    view.actions = actions
+    view.csrf_exempt = True
+    return view
+
+
+def async_urls(urls):
+    """Подменяет в роутах DRF представления, у которых есть
+    async-действия."""
+    patterns = []
+    for pattern in urls:
+        callback = pattern.callback
+        viewset = getattr(callback, 'cls', None)
+        actions = getattr(callback, 'actions', None) or {}
+        if viewset is not None and any(
+                hasattr(viewset, f'a{action}') for action in actions.values()):
+            pattern = URLPattern(
+                pattern.pattern,
+                as_async_view(viewset, actions, **callback.initkwargs),
+                pattern.default_args, pattern.name)
+        patterns.append(pattern)
+    return patterns
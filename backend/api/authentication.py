@@ -0,0 +1,124 @@
+import copy
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+from . import replicas
+
+SHARED_CACHE = 'tokens'
+
+
+class TokenCache:
+    """Кеш "ключ токена -> токен с пользователем".
+
+    Если в CACHES есть кеш tokens (TOKEN_CACHE_BACKEND), записи хранятся
+    в нем, общие для всех воркеров и живут TOKEN_CACHE_TTL секунд.
+    Иначе - LRU в памяти процесса не больше TOKEN_CACHE_SIZE записей:
+    сброс в одном воркере не виден другим, поэтому такие записи живут
+    не дольше TOKEN_CACHE_LOCAL_TTL. Записи сбрасываются сигналами при
+    удалении токена и сохранении пользователя; изменения в обход
+    сигналов (update() по queryset) видны не позже чем через TTL.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self.stats = dict.fromkeys(
+            ('hits', 'misses', 'evictions', 'invalidations'), 0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def shared():
+        if SHARED_CACHE in settings.CACHES:
+            return caches[SHARED_CACHE]
+        return None
+
+    @staticmethod
+    def shared_key(key):
+        return f'token:{key}'
+
+    @staticmethod
+    def local_ttl():
+        return min(settings.TOKEN_CACHE_TTL, settings.TOKEN_CACHE_LOCAL_TTL)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        shared = self.shared()
+        if shared is not None:
+            token = shared.get(self.shared_key(key))
+            self._count('misses' if token is None else 'hits')
+            return token
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return self.clone(entry[1])
+
+    def set(self, key, token):
+        shared = self.shared()
+        if shared is not None:
+            shared.set(self.shared_key(key), token, settings.TOKEN_CACHE_TTL)
+            return
+        with self._lock:
+            self._entries[key] = (monotonic() + self.local_ttl(),
+                                  self.clone(token))
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def delete(self, keys):
+        keys = list(keys)
+        shared = self.shared()
+        if shared is not None:
+            shared.delete_many([self.shared_key(key) for key in keys])
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            self.stats['invalidations'] += len(keys)
+
+    @staticmethod
+    def clone(token):
+        """Каждый запрос получает свои объекты токена и пользователя."""
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который читает токен и пользователя из
+    token_cache и ходит в базу только на промахе. TOKEN_CACHE_TTL=0
+    отключает кеш."""
+
+    def authenticate_credentials(self, key):
+        if not settings.TOKEN_CACHE_TTL:
+            return self.load(key)
+        token = token_cache.get(key)
+        if token is None:
+            user, token = self.load(key)
+            token_cache.set(key, token)
+        return token.user, token
+
+    def load(self, key):
+        """Токен и пользователь - из основной базы: свежий токен после
+        входа или смена пароля еще могут не дойти до реплики."""
+        with replicas.use_primary():
+            return super().authenticate_credentials(key)
@@ -0,0 +1,95 @@
+from django.db import connection, transaction
+
+from recipes import counters, shopping_totals
+from recipes.models import FavoriteRecipe, Recipe, ShoppingList
+
+from . import user_state
+
+INSERT_SQL = (
+    'INSERT INTO {table} (user_id, recipe_id) VALUES {values} '
+    'ON CONFLICT (user_id, recipe_id) DO NOTHING RETURNING recipe_id'
+)
+DELETE_SQL = (
+    'DELETE FROM {table} WHERE user_id = %s AND recipe_id IN ({ids}) '
+    'RETURNING recipe_id'
+)
+
+
+def _execute(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [recipe_id for recipe_id, in cursor.fetchall()]
+
+
+def insert_rows(model, user, recipe_ids):
+    """INSERT без конфликтующих строк; возвращает id рецептов, строки
+    которых действительно вставлены этим запросом."""
+    if not recipe_ids:
+        return []
+    return _execute(INSERT_SQL.format(
+        table=model._meta.db_table,
+        values=', '.join(['(%s, %s)'] * len(recipe_ids))),
+        [value for recipe_id in recipe_ids for value in (user.pk, recipe_id)])
+
+
+def delete_rows(model, user, recipe_ids):
+    """DELETE; возвращает id рецептов, строки которых удалены этим
+    запросом."""
+    if not recipe_ids:
+        return []
+    return _execute(DELETE_SQL.format(
+        table=model._meta.db_table,
+        ids=', '.join(['%s'] * len(recipe_ids))),
+        [user.pk, *recipe_ids])
+
+
+def after_add(model, user, recipe_ids):
+    if model is FavoriteRecipe:
+        counters.change_many(Recipe, recipe_ids, 'favorites_count', 1)
+    elif model is ShoppingList:
+        shopping_totals.add_recipes(recipe_ids, user)
+
+
+def after_remove(model, user, recipe_ids):
+    if model is FavoriteRecipe:
+        counters.change_many(Recipe, recipe_ids, 'favorites_count', -1)
+    elif model is ShoppingList:
+        shopping_totals.subtract_recipes(recipe_ids, user)
+
+
+def sync_state(model, user, recipe_ids, present):
+    name, _ = user_state.TARGETS[model]
+    transaction.on_commit(
+        lambda: user_state.change(user.pk, name, recipe_ids, present))
+
+
+def add(model, user, recipe_ids):
+    """Добавляет рецепты в избранное или список покупок одним INSERT.
+
+    Запрос не шлет post_save, поэтому счетчики, суммы списка покупок и
+    api.user_state обновляются здесь же, запросами на весь набор, и
+    только для строк, которые вставил он сам: параллельный запрос с
+    теми же рецептами их не посчитает второй раз. Возвращает id
+    добавленных рецептов в порядке recipe_ids.
+    """
+    with transaction.atomic():
+        inserted = set(insert_rows(model, user, recipe_ids))
+        added = [recipe_id for recipe_id in recipe_ids
+                 if recipe_id in inserted]
+        if added:
+            after_add(model, user, added)
+            sync_state(model, user, added, True)
+    return added
+
+
+def remove(model, user, recipe_ids):
+    """Убирает рецепты одним DELETE, без сигналов на каждую запись.
+    Возвращает id убранных рецептов в порядке recipe_ids."""
+    with transaction.atomic():
+        deleted = set(delete_rows(model, user, recipe_ids))
+        removed = [recipe_id for recipe_id in recipe_ids
+                   if recipe_id in deleted]
+        if removed:
+            after_remove(model, user, removed)
+            sync_state(model, user, removed, False)
+    return removed
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+
+from recipes.versions import (aget_reference_version, aget_version,
+                              bump_version, get_reference_version,
+                              get_version, reference_cache)
+
+PAGE_VERSION_KEY = 'pages:version'
+
+
+def is_shared(cache):
+    """Видят ли кеш все воркеры: память процесса и заглушка - нет."""
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def page_cache():
+    return caches['pages']
+
+
+def bump_page_version():
+    """Делает устаревшими все закешированные страницы рецептов."""
+    bump_version(page_cache(), PAGE_VERSION_KEY)
+
+
+def render_body(view, request, data):
+    body = request.accepted_renderer.render(
+        data, request.accepted_media_type, view.get_renderer_context())
+    return '"{}"'.format(hashlib.md5(body).hexdigest()), body
+
+
+def body_response(request, cached):
+    etag, body = cached
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(
+            body, content_type=request.accepted_renderer.media_type)
+    response['ETag'] = etag
+    return response
+
+
+class ReferenceCacheMixin:
+    """Кеширует готовый JSON списка и деталей справочника.
+
+    Ключ включает номер версии справочников, поэтому при изменении
+    тегов или ингредиентов старые ответы просто перестают читаться.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request,
+                                    *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(super().alist, request,
+                                           *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(super().aretrieve, request,
+                                           *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        cache = reference_cache()
+        key = self.reference_cache_key(request, get_reference_version())
+        cached = cache.get(key)
+        if cached is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cached = render_body(self, request, response.data)
+            cache.set(key, cached)
+        return body_response(request, cached)
+
+    async def acached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return await handler(request, *args, **kwargs)
+        cache = reference_cache()
+        key = self.reference_cache_key(request,
+                                       await aget_reference_version())
+        cached = await cache.aget(key)
+        if cached is None:
+            response = await handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cached = render_body(self, request, response.data)
+            await cache.aset(key, cached)
+        return body_response(request, cached)
+
+    @staticmethod
+    def reference_cache_key(request, version):
+        return 'reference:{}:{}'.format(version, request.get_full_path())
+
+
+class PageCacheMixin:
+    """Кеш готовых ответов для анонимных GET.
+
+    Ключ - адрес и отсортированные параметры из page_cache_params;
+    запросы с другими параметрами, от пользователей и не в JSON
+    не кешируются. Ответ свеж PAGE_CACHE_TTL секунд и пока не сдвинута
+    версия страниц (сигналы изменения рецептов, тегов и авторов). Потом
+    еще PAGE_CACHE_STALE секунд его получают все, кроме одного запроса,
+    который взял блокировку и строит ответ заново; без готового ответа
+    остальные async-запросы ждут этот запрос, а не идут в базу
+    (синхронные строят ответ сами). Если построение вернуло не 200
+    (например, 404 для удаленного рецепта), старая запись удаляется.
+    """
+    page_cache_params = ()
+    fresh, stale, missing = 'fresh', 'stale', 'missing'
+
+    def page_cached_response(self, handler, request, *args, **kwargs):
+        key = self.page_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+        cache = page_cache()
+        version = get_version(cache, PAGE_VERSION_KEY)
+        entry = cache.get(key)
+        status = self.page_status(entry, version)
+        if status == self.fresh:
+            return body_response(request, entry[2:])
+        if cache.add(key + ':lock', 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+            try:
+                response = handler(request, *args, **kwargs)
+                entry = self.page_entry(request, response, version)
+                if entry is None:
+                    cache.delete(key)
+                    return response
+                cache.set(key, entry, self.page_timeout())
+            except Http404:
+                cache.delete(key)
+                raise
+            finally:
+                cache.delete(key + ':lock')
+            return body_response(request, entry[2:])
+        if status == self.stale:
+            return body_response(request, entry[2:])
+        # Синхронный воркер не ждет чужое построение: пока он спит,
+        # он не обслуживает другие запросы.
+        return handler(request, *args, **kwargs)
+
+    async def apage_cached_response(self, handler, request, *args, **kwargs):
+        key = self.page_cache_key(request)
+        if key is None:
+            return await handler(request, *args, **kwargs)
+        cache = page_cache()
+        version = await aget_version(cache, PAGE_VERSION_KEY)
+        deadline = time.monotonic() + settings.PAGE_CACHE_LOCK_TIMEOUT
+        entry = await cache.aget(key)
+        while True:
+            status = self.page_status(entry, version)
+            if status == self.fresh:
+                return body_response(request, entry[2:])
+            if await cache.aadd(key + ':lock', 1,
+                                settings.PAGE_CACHE_LOCK_TIMEOUT):
+                try:
+                    response = await handler(request, *args, **kwargs)
+                    entry = self.page_entry(request, response, version)
+                    if entry is None:
+                        await cache.adelete(key)
+                        return response
+                    await cache.aset(key, entry, self.page_timeout())
+                except Http404:
+                    await cache.adelete(key)
+                    raise
+                finally:
+                    await cache.adelete(key + ':lock')
+                return body_response(request, entry[2:])
+            if status == self.stale:
+                return body_response(request, entry[2:])
+            if time.monotonic() > deadline:
+                return await handler(request, *args, **kwargs)
+            await asyncio.sleep(settings.PAGE_CACHE_POLL)
+            entry = await cache.aget(key)
+
+    def page_cache_key(self, request):
+        """Ключ страницы или None, если запрос не кешируется."""
+        params = request.query_params
+        if (not settings.PAGE_CACHE_TTL or request.user.is_authenticated
+                or request.accepted_renderer.format != 'json'
+                or not set(params) <= set(self.page_cache_params)):
+            return None
+        query = urlencode(sorted((name, params.getlist(name))
+                                 for name in params), doseq=True)
+        url = '{}?{}'.format(request.build_absolute_uri(request.path), query)
+        return 'page:' + hashlib.md5(url.encode()).hexdigest()
+
+    def page_status(self, entry, version):
+        if entry is None:
+            return self.missing
+        age = time.time() - entry[0]
+        if entry[1] == version and age < settings.PAGE_CACHE_TTL:
+            return self.fresh
+        if age < settings.PAGE_CACHE_TTL + settings.PAGE_CACHE_STALE:
+            return self.stale
+        return self.missing
+
+    def page_entry(self, request, response, version):
+        """Запись для кеша: время, версия, ETag и тело; None для ответов,
+        которые не кешируются."""
+        if response.status_code != 200:
+            return None
+        return (time.time(), version,
+                *render_body(self, request, response.data))
+
+    @staticmethod
+    def page_timeout():
+        return settings.PAGE_CACHE_TTL + settings.PAGE_CACHE_STALE
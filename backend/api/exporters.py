@@ -0,0 +1,56 @@
+import csv
+import json
+
+from recipes.models import ShoppingListTotal
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает записанную строку."""
+    def write(self, value):
+        return value
+
+
+def shopping_list(user):
+    """Сводный список покупок пользователя по алфавиту."""
+    return (
+        ShoppingListTotal.objects
+        .filter(user=user)
+        .values_list('ingredient__name', 'total_amount',
+                     'ingredient__measurement_unit')
+        .order_by('ingredient__name')
+        .iterator()
+    )
+
+
+def export_txt(ingredients):
+    yield 'Cписок покупок:\n'
+    separator = ''
+    for ingredient in ingredients:
+        yield separator + '{} - {} {}.'.format(*ingredient)
+        separator = '\n'
+
+
+def export_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for ingredient in ingredients:
+        yield writer.writerow(ingredient)
+
+
+def export_json(ingredients):
+    yield '['
+    separator = ''
+    for name, amount, measurement_unit in ingredients:
+        yield separator + json.dumps(
+            {'name': name, 'amount': amount,
+             'measurement_unit': measurement_unit},
+            ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+EXPORTERS = {
+    'txt': export_txt,
+    'csv': export_csv,
+    'json': export_json,
+}
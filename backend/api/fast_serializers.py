@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+from recipes.models import AmountIngredient, Tag
+
+from . import user_state
+from .metrics import serializer_timer
+from .serializers import image_url
+
+RECIPE_FIELDS = (
+    'id', 'name', 'image', 'image_status', 'text', 'cooking_time',
+    'pub_date', 'favorites_count', 'author__email', 'author_id',
+    'author__username', 'author__first_name', 'author__last_name',
+)
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_FIELDS = ('id', 'name', 'amount', 'measurement_unit')
+
+
+def recipe_rows(queryset):
+    """Тот же queryset рецептов, но строками .values(): без моделей и
+    prefetch. Аннотации (например, релевантность поиска) сохраняются."""
+    return queryset.prefetch_related(None).values(
+        *RECIPE_FIELDS, *queryset.query.annotations)
+
+
+def recipe_tags(recipe_ids):
+    """Теги рецептов: {id рецепта: [тег, ...]}, словари тегов общие."""
+    tags = {}
+    result = defaultdict(list)
+    for recipe_id, *tag in Tag.objects.filter(
+        recipes__in=recipe_ids
+    ).order_by('id').values_list('recipes', *TAG_FIELDS):
+        if tag[0] not in tags:
+            tags[tag[0]] = dict(zip(TAG_FIELDS, tag))
+        result[recipe_id].append(tags[tag[0]])
+    return result
+
+
+def recipe_ingredients(recipe_ids):
+    """Ингредиенты рецептов: {id рецепта: [ингредиент, ...]}."""
+    result = defaultdict(list)
+    for recipe_id, *ingredient in AmountIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('id').values_list(
+        'recipe_id', 'ingredient_id', 'ingredient__name', 'amount',
+        'ingredient__measurement_unit'
+    ):
+        result[recipe_id].append(dict(zip(INGREDIENT_FIELDS, ingredient)))
+    return result
+
+
+def serialize_recipes(rows, request):
+    """Список рецептов в формате RecipeListSerializer из строк
+    recipe_rows: два запроса на страницу и словари без полей DRF."""
+    recipe_ids = [row['id'] for row in rows]
+    tags = recipe_tags(recipe_ids)
+    ingredients = recipe_ingredients(recipe_ids)
+    state = user_state.for_request(request)
+    with serializer_timer():
+        return build_recipes(rows, request, tags, ingredients, state)
+
+
+def build_recipes(rows, request, tags, ingredients, state):
+    return [{
+        'id': row['id'],
+        'tags': tags[row['id']],
+        'author': {
+            'email': row['author__email'],
+            'id': row['author_id'],
+            'username': row['author__username'],
+            'first_name': row['author__first_name'],
+            'last_name': row['author__last_name'],
+            'is_subscribed': state.is_subscribed(row['author_id']),
+        },
+        'ingredients': ingredients[row['id']],
+        'is_favorited': state.is_favorited(row['id']),
+        'is_in_shopping_cart': state.is_in_shopping_cart(row['id']),
+        'name': row['name'],
+        'image': (image_url(request, row['image'], row['image_status'])
+                  if row['image'] else None),
+        'text': row['text'],
+        'cooking_time': row['cooking_time'],
+    } for row in rows]
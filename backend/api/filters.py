@@ -1,6 +1,24 @@
+from django.conf import settings
+from django.db.models import BooleanField, Case, Value, When
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Recipe, Tag
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_recipes
+
+
+class IngredientFilter(FilterSet):
+    name = filters.CharFilter(method='name_filter')
+
+    class Meta:
+        model = Ingredient
+        fields = ('name',)
+
+    def name_filter(self, queryset, name, value):
+        return queryset.filter(name__icontains=value).annotate(
+            is_prefix=Case(When(name__istartswith=value, then=Value(True)),
+                           default=Value(False),
+                           output_field=BooleanField())
+        ).order_by('-is_prefix', 'name')[:settings.INGREDIENT_SEARCH_LIMIT]
 
 
 class RecipeFilter(FilterSet):
@@ -11,6 +29,7 @@ class RecipeFilter(FilterSet):
         method='is_favorited_filter')
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_filter')
+    search = filters.CharFilter(method='search_filter')
 
     class Meta:
         model = Recipe
@@ -27,3 +46,6 @@ class RecipeFilter(FilterSet):
         if value and user.is_authenticated:
             return queryset.filter(shopping_lists__user=user)
         return queryset
+
+    def search_filter(self, queryset, name, value):
+        return search_recipes(queryset, value)
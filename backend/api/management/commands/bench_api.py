@@ -0,0 +1,117 @@
+import json
+import statistics
+import tempfile
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe, Tag
+from user.models import CustomUser
+
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAf'
+         'FcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+
+
+class Command(BaseCommand):
+    help = 'measure API latency and query counts in process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', type=str,
+                            help='Файл для результатов в JSON')
+
+    def get_user(self):
+        user = (CustomUser.objects.filter(follower__isnull=False,
+                                          shopping_lists__isnull=False,
+                                          recipes__isnull=False)
+                .order_by('id').first())
+        if user is None:
+            raise CommandError('Нет данных: запустите seed_bench.')
+        return user
+
+    def recipe_body(self):
+        return {
+            'name': 'Бенчмарк', 'text': 'Описание', 'cooking_time': 10,
+            'image': IMAGE,
+            'tags': list(Tag.objects.values_list('id', flat=True)[:2]),
+            'ingredients': [
+                {'id': ingredient, 'amount': 10}
+                for ingredient in Ingredient.objects.values_list(
+                    'id', flat=True)[:10]
+            ],
+        }
+
+    def get_scenarios(self, user):
+        tag = Tag.objects.order_by('id').first()
+        recipe = Recipe.objects.filter(author=user).first()
+        body = self.recipe_body()
+        scenarios = [
+            ('recipes_list', 'get', '/api/recipes/', None),
+            ('recipes_filtered', 'get',
+             f'/api/recipes/?tags={tag.slug}&is_favorited=1', None),
+            ('recipes_author', 'get', f'/api/recipes/?author={user.id}',
+             None),
+            ('recipes_cursor', 'get',
+             '/api/recipes/?cursor=&skip_count=1', None),
+            ('subscriptions', 'get',
+             '/api/users/subscriptions/?recipes_limit=3', None),
+            ('download_shopping_cart', 'get',
+             '/api/recipes/download_shopping_cart/', None),
+            ('recipe_create', 'post', '/api/recipes/', body),
+        ]
+        if recipe is not None:
+            scenarios.append(('recipe_update', 'patch',
+                              f'/api/recipes/{recipe.id}/', body))
+        return scenarios
+
+    def run(self, client, method, url, body):
+        with transaction.atomic(), \
+                CaptureQueriesContext(connection) as queries:
+            started = perf_counter()
+            response = getattr(client, method)(url, body, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = perf_counter() - started
+            transaction.set_rollback(True)
+        return response.status_code, elapsed, len(queries)
+
+    def handle(self, *args, **options):
+        user = self.get_user()
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        results = {}
+        with tempfile.TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media, IMAGE_WORKERS=0):
+            for name, method, url, body in self.get_scenarios(user):
+                runs = [self.run(client, method, url, body)
+                        for _ in range(options['repeat'])]
+                timings = sorted(elapsed * 1000 for _, elapsed, _ in runs)
+                results[name] = {
+                    'url': url,
+                    'status': runs[-1][0],
+                    'p50_ms': round(statistics.median(timings), 2),
+                    'p95_ms': round(
+                        timings[int(0.95 * (len(timings) - 1))], 2),
+                    'queries': runs[-1][2],
+                }
+                self.stdout.write(
+                    '{:<24} {status} p50 {p50_ms:>8} ms  '
+                    'p95 {p95_ms:>8} ms  {queries:>3} запросов'.format(
+                        name, **results[name]))
+        report = {
+            'created': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'recipes': Recipe.objects.count(),
+            'users': CustomUser.objects.count(),
+            'repeat': options['repeat'],
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
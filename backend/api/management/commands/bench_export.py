@@ -0,0 +1,123 @@
+import json
+import statistics
+import tracemalloc
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.http import HttpResponse, StreamingHttpResponse
+
+from api import batch
+from api.exporters import EXPORTERS, shopping_list
+from recipes.models import AmountIngredient, Recipe, ShoppingList
+from user.models import CustomUser
+
+
+def in_memory(user):
+    """Прежняя выгрузка: весь список собирается в памяти одной строкой."""
+    ingredients = (
+        AmountIngredient.objects
+        .filter(recipe__shopping_lists__user=user)
+        .values('ingredient')
+        .annotate(total_amount=Sum('amount'))
+        .values_list('ingredient__name', 'total_amount',
+                     'ingredient__measurement_unit')
+    )
+    file_list = []
+    [file_list.append(
+        '{} - {} {}.'.format(*ingredient)) for ingredient in ingredients]
+    return HttpResponse('Cписок покупок:\n' + '\n'.join(file_list),
+                        content_type='text/plain')
+
+
+def streaming(user, format='txt'):
+    """Текущая выгрузка download_shopping_cart."""
+    return StreamingHttpResponse(
+        EXPORTERS[format](shopping_list(user)),
+        content_type='text/plain; charset=utf-8')
+
+
+class Command(BaseCommand):
+    help = 'compare memory and first byte time of shopping list exports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--format', default='txt', choices=EXPORTERS,
+                            help='Формат потоковой выгрузки')
+        parser.add_argument('--cart', type=int, default=0,
+                            help='Дополнить корзину до N рецептов на время '
+                                 'замера (изменения откатываются)')
+        parser.add_argument('--output', type=str,
+                            help='Файл для результатов в JSON')
+
+    def get_user(self):
+        user = (CustomUser.objects.annotate(carted=Count('shopping_lists'))
+                .filter(carted__gt=0).order_by('-carted').first())
+        if user is None:
+            raise CommandError('Нет данных: запустите seed_bench.')
+        return user
+
+    @staticmethod
+    def consume(build, user, *args):
+        """Время до первого куска, общее время и размер ответа. Куски не
+        накапливаются, как при отдаче клиенту."""
+        started = perf_counter()
+        first_byte = None
+        size = 0
+        for chunk in build(user, *args):
+            if first_byte is None:
+                first_byte = perf_counter() - started
+            size += len(chunk)
+        return first_byte, perf_counter() - started, size
+
+    def measure(self, build, user, *args, repeat):
+        timings = [self.consume(build, user, *args) for _ in range(repeat)]
+        tracemalloc.start()
+        try:
+            self.consume(build, user, *args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {
+            'peak_kib': round(peak / 1024, 1),
+            'first_byte_ms': round(statistics.median(
+                first_byte for first_byte, _, _ in timings) * 1e3, 2),
+            'total_ms': round(statistics.median(
+                total for _, total, _ in timings) * 1e3, 2),
+            'bytes': timings[0][2],
+        }
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            results = self.compare(self.get_user(), options)
+            transaction.set_rollback(True)
+        for name, result in results.items():
+            self.stdout.write(
+                '{:<10} пик {peak_kib:>9} КиБ  первый байт '
+                '{first_byte_ms:>8} мс  всего {total_ms:>8} мс  '
+                '{bytes} байт'.format(name, **result))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+
+    def fill_cart(self, user, size):
+        carted = ShoppingList.objects.filter(user=user).count()
+        if size > carted:
+            batch.add(ShoppingList, user, list(
+                Recipe.objects.exclude(shopping_lists__user=user)
+                .order_by('id').values_list('id', flat=True)[
+                    :size - carted]))
+
+    def compare(self, user, options):
+        self.fill_cart(user, options['cart'])
+        old = b''.join(in_memory(user)).decode()
+        new = b''.join(streaming(user)).decode()
+        if sorted(old.splitlines()) != sorted(new.splitlines()):
+            raise CommandError('Выгрузки расходятся.')
+        return {
+            'in_memory': self.measure(in_memory, user,
+                                      repeat=options['repeat']),
+            'streaming': self.measure(streaming, user, options['format'],
+                                      repeat=options['repeat']),
+        }
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import statistics
+from time import perf_counter
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+from user.models import CustomUser
+
+
+class Client:
+    """Минимальный HTTP/1.1-клиент с keep-alive на asyncio."""
+
+    def __init__(self, host, port, headers):
+        self.host, self.port = host, port
+        self.headers = ''.join(f'{name}: {value}\r\n'
+                               for name, value in headers.items())
+        self.reader = self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+        self.writer.write(
+            f'GET {path} HTTP/1.1\r\nHost: {self.host}\r\n'
+            f'{self.headers}\r\n'.encode())
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length, keep_alive = None, True
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name, value = name.lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value == 'close':
+                keep_alive = False
+        if length is None:
+            await self.reader.read()
+            keep_alive = False
+        else:
+            await self.reader.readexactly(length)
+        if not keep_alive:
+            await self.close()
+        return status
+
+
+class Command(BaseCommand):
+    help = 'measure throughput of a running server at high concurrency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help='Адрес запущенного сервера')
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help='Число одновременных соединений')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Секунд на каждый сценарий')
+        parser.add_argument('--label', default='',
+                            help='Подпись запуска, например wsgi или asgi')
+        parser.add_argument('--output', type=str,
+                            help='Файл для результатов в JSON')
+
+    def get_scenarios(self):
+        user = (CustomUser.objects.filter(follower__isnull=False)
+                .order_by('id').first())
+        recipe = Recipe.objects.order_by('id').first()
+        if user is None or recipe is None:
+            raise CommandError('Нет данных: запустите seed_bench.')
+        token, _ = Token.objects.get_or_create(user=user)
+        tag = Tag.objects.order_by('id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        return token.key, [
+            ('recipes_list', '/api/recipes/'),
+            ('recipes_filtered', f'/api/recipes/?tags={tag.slug}'),
+            ('recipe_detail', f'/api/recipes/{recipe.id}/'),
+            ('tags', '/api/tags/'),
+            ('ingredients_search',
+             f'/api/ingredients/?name={quote(ingredient.name[:3])}'),
+            ('subscriptions', '/api/users/subscriptions/?recipes_limit=3'),
+        ]
+
+    async def worker(self, client, path, deadline, timings, errors):
+        while perf_counter() < deadline:
+            started = perf_counter()
+            try:
+                status = await client.get(path)
+            except (OSError, ValueError, IndexError,
+                    asyncio.IncompleteReadError):
+                await client.close()
+                errors.append(None)
+                continue
+            if status != 200:
+                errors.append(status)
+            timings.append(perf_counter() - started)
+        await client.close()
+
+    async def run(self, host, port, headers, path, options):
+        timings, errors = [], []
+        started = perf_counter()
+        deadline = started + options['duration']
+        await asyncio.gather(*(
+            self.worker(Client(host, port, headers), path, deadline,
+                        timings, errors)
+            for _ in range(options['concurrency'])
+        ))
+        elapsed = perf_counter() - started
+        timings = sorted(timing * 1000 for timing in timings) or [0]
+        return {
+            'url': path,
+            'requests': len(timings),
+            'rps': round(len(timings) / elapsed, 1),
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(timings[int(0.95 * (len(timings) - 1))], 2),
+            'errors': len(errors),
+        }
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        token, scenarios = self.get_scenarios()
+        headers = {'Authorization': f'Token {token}',
+                   'Accept': 'application/json'}
+        results = {}
+        for name, path in scenarios:
+            results[name] = asyncio.run(self.run(
+                url.hostname, url.port or 80, headers, path, options))
+            self.stdout.write(
+                '{:<20} {rps:>8} rps  p50 {p50_ms:>8} ms  '
+                'p95 {p95_ms:>8} ms  ошибок {errors}'.format(
+                    name, **results[name]))
+        report = {
+            'created': timezone.now().isoformat(),
+            'label': options['label'],
+            'url': options['url'],
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,82 @@
+import json
+import statistics
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.fast_serializers import recipe_rows, serialize_recipes
+from api.renderers import ORJSONRenderer
+from api.serializers import RecipeListSerializer
+from api.views import RecipeViewSet
+from user.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'compare per-recipe cost of recipe list serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='6,50,200',
+                            help='Размеры страниц через запятую')
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--image-size', type=str,
+                            help='Параметр ?image_size= запроса')
+        parser.add_argument('--output', type=str,
+                            help='Файл для результатов в JSON')
+
+    def get_view(self, image_size):
+        user = (CustomUser.objects.filter(follower__isnull=False)
+                .order_by('id').first())
+        if user is None:
+            raise CommandError('Нет данных: запустите seed_bench.')
+        params = {'image_size': image_size} if image_size else {}
+        request = APIRequestFactory().get('/api/recipes/', params)
+        force_authenticate(request, user)
+        view = RecipeViewSet(action_map={'get': 'list'}, args=(), kwargs={},
+                             format_kwarg=None)
+        view.request = view.initialize_request(request)
+        return view
+
+    @staticmethod
+    def drf(queryset, request, size):
+        data = RecipeListSerializer(list(queryset[:size]), many=True,
+                                    context={'request': request}).data
+        return JSONRenderer().render(data)
+
+    @staticmethod
+    def fast(queryset, request, size):
+        rows = list(recipe_rows(queryset)[:size])
+        return ORJSONRenderer().render(serialize_recipes(rows, request))
+
+    def measure(self, render, queryset, request, size, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = perf_counter()
+            render(queryset, request, size)
+            timings.append(perf_counter() - started)
+        return round(statistics.median(timings) * 1e6 / size, 1)
+
+    def handle(self, *args, **options):
+        view = self.get_view(options['image_size'])
+        request = view.request
+        queryset = view.get_queryset()
+        results = {}
+        for size in map(int, options['sizes'].split(',')):
+            if self.drf(queryset, request, size) != self.fast(
+                    queryset, request, size):
+                raise CommandError(
+                    f'Ответы сериализаторов расходятся на {size} рецептах.')
+            results[size] = {
+                'drf_us_per_recipe': self.measure(
+                    self.drf, queryset, request, size, options['repeat']),
+                'fast_us_per_recipe': self.measure(
+                    self.fast, queryset, request, size, options['repeat']),
+            }
+            self.stdout.write(
+                '{:>5} рецептов  DRF {drf_us_per_recipe:>8} мкс  '
+                'fast {fast_us_per_recipe:>8} мкс на рецепт'.format(
+                    size, **results[size]))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,117 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+from recipes import images
+
+from .authentication import token_cache
+
+FIELDS = (
+    ('requests', 'foodgram_requests_total', 'Число запросов'),
+    ('queries', 'foodgram_db_queries_total', 'Число SQL-запросов'),
+    ('db_seconds', 'foodgram_db_seconds_total', 'Время SQL, с'),
+    ('serializer_seconds', 'foodgram_serializer_seconds_total',
+     'Время сериализации, с'),
+    ('seconds', 'foodgram_request_seconds_total', 'Время ответа, с'),
+    ('response_bytes', 'foodgram_response_bytes_total',
+     'Размер ответов, байт'),
+    ('over_budget', 'foodgram_query_budget_exceeded_total',
+     'Превышений бюджета запросов'),
+)
+
+request_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """SQL-запросы, время SQL и время сериализации одного HTTP-запроса."""
+    __slots__ = ('queries', 'db_seconds', 'serializer_seconds',
+                 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+
+
+def count_query(execute, sql, params, many, context):
+    """execute_wrapper на каждом соединении: считает запрос в статистику
+    HTTP-запроса из текущего контекста. Под ASGI запросы разных
+    HTTP-запросов идут через одно соединение потока ORM, но каждый
+    sync_to_async выполняется в контексте своего запроса."""
+    stats = request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += perf_counter() - started
+
+
+def install_query_counter(connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@contextmanager
+def serializer_timer():
+    """Время сериализации; вложенные сериализаторы не считаются второй
+    раз. SQL внутри сериализации входит и в это время."""
+    stats = request_stats.get()
+    if stats is None or stats.serializing:
+        yield
+        return
+    stats.serializing = True
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_seconds += perf_counter() - started
+        stats.serializing = False
+
+
+class EndpointMetrics:
+    """Накопленные в процессе метрики по эндпоинтам."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._endpoints = defaultdict(lambda: dict.fromkeys(
+            (field for field, _, _ in FIELDS), 0))
+
+    def record(self, endpoint, **values):
+        with self._lock:
+            stats = self._endpoints[endpoint]
+            for key, value in values.items():
+                stats[key] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(stats)
+                    for endpoint, stats in self._endpoints.items()}
+
+
+endpoint_metrics = EndpointMetrics()
+
+
+def render():
+    """Метрики в текстовом формате Prometheus."""
+    lines = []
+    snapshot = endpoint_metrics.snapshot()
+    for field, name, description in FIELDS:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} counter')
+        for endpoint, stats in sorted(snapshot.items()):
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {stats[field]}')
+    for key, value in sorted(images.stats.items()):
+        lines.append(f'# TYPE foodgram_images_{key}_total counter')
+        lines.append(f'foodgram_images_{key}_total {value}')
+    for key, value in sorted(token_cache.stats.items()):
+        lines.append(f'# TYPE foodgram_token_cache_{key}_total counter')
+        lines.append(f'foodgram_token_cache_{key}_total {value}')
+    lines.append('# TYPE foodgram_token_cache_size gauge')
+    lines.append(f'foodgram_token_cache_size {len(token_cache)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,163 @@
+import logging
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from . import replicas
+from .cache import is_shared
+from .metrics import (RequestStats, endpoint_metrics, install_query_counter,
+                      request_stats)
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def get_endpoint(request, view_func):
+    """Имя эндпоинта: RecipeViewSet.list, UserViewSet.subscriptions."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        match = request.resolver_match
+        return match.view_name if match else 'unknown'
+    action = (getattr(view_func, 'actions', None) or {}).get(
+        request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+class QueryBudgetMiddleware:
+    """Считает SQL-запросы, время SQL, время сериализации и размер ответа
+    каждого запроса.
+
+    Пишет их в заголовок Server-Timing и в метрики /api/metrics.
+    Если эндпоинт превысил бюджет из QUERY_BUDGETS, пишет в лог,
+    а при QUERY_BUDGET_STRICT=True бросает исключение (для тестов).
+    Счетчик запросов стоит на каждом соединении один раз
+    (api.metrics.count_query) и пишет в статистику из контекста
+    запроса, поэтому параллельные ASGI-запросы не смешиваются.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all():
+            install_query_counter(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_stats.reset(token)
+        return self.finish(request, response, stats,
+                           perf_counter() - started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_stats.reset(token)
+        return self.finish(request, response, stats,
+                           perf_counter() - started)
+
+    def finish(self, request, response, stats, seconds):
+        endpoint = getattr(request, 'endpoint', None)
+        if endpoint is None:
+            return response
+
+        size = 0 if response.streaming else len(response.content)
+        budget = settings.QUERY_BUDGETS.get(endpoint)
+        over_budget = budget is not None and stats.queries > budget
+        endpoint_metrics.record(
+            endpoint, requests=1, queries=stats.queries,
+            db_seconds=stats.db_seconds,
+            serializer_seconds=stats.serializer_seconds, seconds=seconds,
+            response_bytes=size, over_budget=int(over_budget))
+        response['Server-Timing'] = (
+            'db;desc="{} queries";dur={:.2f}, serializer;dur={:.2f}, '
+            'app;dur={:.2f}, total;dur={:.2f}'.format(
+                stats.queries, stats.db_seconds * 1000,
+                stats.serializer_seconds * 1000,
+                (seconds - stats.db_seconds) * 1000, seconds * 1000))
+        if over_budget:
+            message = (f'{endpoint}: {stats.queries} SQL-запросов '
+                       f'при бюджете {budget}')
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.endpoint = get_endpoint(request, view_func)
+
+
+class ReplicaMiddleware:
+    """Отправляет чтения безопасных запросов к REPLICA_READ_VIEWS в
+    реплику, выбранную на весь запрос.
+
+    После успешной записи клиент REPLICA_STICKY_SECONDS секунд читает
+    из основной базы и видит свои изменения.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        if (replicas.replica_aliases()
+                and not is_shared(caches[DEFAULT_CACHE_ALIAS])):
+            logger.warning(
+                'DB_REPLICAS без общего кеша (CACHE_BACKEND): признак '
+                '"читать из основной БД" после записи виден только '
+                'воркеру, который принял запись.')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = replicas.read_alias.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            replicas.read_alias.reset(token)
+        self.remember_write(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = replicas.read_alias.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            replicas.read_alias.reset(token)
+        self.remember_write(request, response)
+        return response
+
+    @staticmethod
+    def remember_write(request, response):
+        if (request.method not in SAFE_METHODS
+                and response.status_code < 400
+                and replicas.replica_aliases()):
+            replicas.stick(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (request.method in SAFE_METHODS
+                and replicas.replica_aliases()
+                and replicas.is_replica_view(
+                    get_endpoint(request, view_func))
+                and not replicas.is_sticky(request)):
+            replicas.read_alias.set(replicas.choose_replica())
@@ -1,5 +1,198 @@
+import asyncio
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPaginator(PageNumberPagination):
+    """Постраничная пагинация с переходом на курсоры по запросу.
+
+    Без параметра cursor работает как обычно: page/limit и
+    count/next/previous/results. С ?cursor= (пустым для первой
+    страницы) выдает страницы по ключу сортировки плюс id, без OFFSET,
+    поэтому дальние страницы стоят столько же, сколько первая.
+    ?skip_count=1 убирает из ответа count и запрос COUNT(*).
+    """
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    skip_count_query_param = 'skip_count'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.count = None
+        if request.query_params.get(self.skip_count_query_param) not in (
+                '1', 'true', 'True'):
+            self.count = queryset.count()
+
+        reverse, position = self.decode_cursor(request, queryset)
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.invert(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results and (has_more or reverse):
+            self.next_position = self.get_position(results[-1])
+        if results and (position is not None) and (has_more or not reverse):
+            self.previous_position = self.get_position(results[0])
+        return results
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async-версия для страниц по номеру: COUNT(*) и строки
+        страницы запрашиваются одновременно. Курсоры и номера вроде
+        last обрабатываются синхронной версией."""
+        number = request.query_params.get(self.page_query_param) or '1'
+        if (self.cursor_query_param in request.query_params
+                or not number.isdigit() or int(number) < 1):
+            return await sync_to_async(self.paginate_queryset)(
+                queryset, request, view)
+        self.keyset = False
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        offset = (int(number) - 1) * page_size
+
+        async def rows():
+            return [row async for row in queryset[offset:offset + page_size]]
+
+        paginator.count, results = await asyncio.gather(
+            queryset.acount(), rows())
+        try:
+            self.page = paginator.page(number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=number, message=str(exc)))
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(False, self.next_position)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(True, self.previous_position)
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by
+                        or queryset.model._meta.ordering)
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return ordering
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def after(ordering, position):
+        """Условие "строго после позиции" для составного ключа."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_position(self, instance):
+        if isinstance(instance, dict):
+            return [instance[field.lstrip('-')] for field in self.ordering]
+        return [getattr(instance, field.lstrip('-'))
+                for field in self.ordering]
+
+    def encode_cursor(self, reverse, position):
+        cursor = json.dumps([reverse, position], default=str)
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   b64encode(cursor.encode()).decode())
+
+    @staticmethod
+    def get_field(queryset, name):
+        """Поле модели или аннотации, по которому идет сортировка."""
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        opts = queryset.model._meta
+        *path, name = name.split(LOOKUP_SEP)
+        for part in path:
+            opts = opts.get_field(part).related_model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    def clean_value(self, queryset, field, value):
+        """Значение позиции в типе поля; None, списки и словари, а также
+        значения, которые поле не принимает или которые не помещаются в
+        его столбец, - ошибка."""
+        if value is None or isinstance(value, (list, dict)):
+            raise ValueError(value)
+        field = self.get_field(queryset, field.lstrip('-'))
+        value = field.to_python(value)
+        field.run_validators(value)
+        low, high = BaseDatabaseOperations.integer_field_ranges.get(
+            field.get_internal_type(), (None, None))
+        if low is not None and not low <= value <= high:
+            raise ValueError(value)
+        return value
+
+    def decode_cursor(self, request, queryset):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return False, None
+        try:
+            reverse, position = json.loads(b64decode(cursor.encode()))
+            if (not isinstance(reverse, bool)
+                    or not isinstance(position, list)
+                    or len(position) != len(self.ordering)):
+                raise ValueError(cursor)
+            position = [self.clean_value(queryset, field, value)
+                        for field, value in zip(self.ordering, position)]
+        except (TypeError, ValueError, BinasciiError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
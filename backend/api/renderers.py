@@ -0,0 +1,57 @@
+import json
+
+from django.utils.encoding import smart_bytes
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class PlainTextRenderer(BaseRenderer):
+    """Отдает текст как есть, нужен для выбора формата выгрузки."""
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not isinstance(data, str):
+            data = json.dumps(data, ensure_ascii=False)
+        return smart_bytes(data, self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson с тем же результатом: компактный UTF-8,
+    U+2028/U+2029 экранированы, даты, Decimal и ленивые строки - через
+    кодировщик DRF. С отступом, без orjson или на значениях, которые
+    orjson не кодирует (целые больше 64 бит), работает как JSONRenderer.
+    """
+    options = 0 if orjson is None else (orjson.OPT_NON_STR_KEYS
+                                        | orjson.OPT_PASSTHROUGH_DATETIME)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or not api_settings.UNICODE_JSON
+                or not api_settings.COMPACT_JSON
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {})):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029')
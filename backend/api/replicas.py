@@ -0,0 +1,72 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+read_alias = ContextVar('read_alias', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in connections if alias != DEFAULT_DB_ALIAS]
+
+
+def choose_replica():
+    aliases = replica_aliases()
+    return random.choice(aliases) if aliases else None
+
+
+def is_replica_view(endpoint):
+    return any(endpoint == view or endpoint.startswith(f'{view}.')
+               for view in settings.REPLICA_READ_VIEWS)
+
+
+def sticky_key(request):
+    """Ключ клиента для чтения своих записей: токен или сессия."""
+    credentials = (request.headers.get('Authorization')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credentials:
+        return None
+    return 'replica:sticky:{}'.format(
+        hashlib.md5(credentials.encode()).hexdigest())
+
+
+def is_sticky(request):
+    key = sticky_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+def stick(request):
+    """После записи клиент какое-то время читает из основной базы,
+    пока реплики догоняют."""
+    key = sticky_key(request)
+    if key is not None:
+        cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+
+
+@contextmanager
+def use_primary():
+    """Чтения внутри блока идут в основную базу, даже если запрос
+    читает из реплики."""
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """Чтения запросов, помеченных ReplicaMiddleware, идут в выбранную
+    для запроса реплику, все записи - в основную базу."""
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
@@ -1,29 +1,105 @@
 import base64
+import binascii
 import logging
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
 from django.db import transaction
+from django.db.models import F, Prefetch, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
+from PIL import Image
 from rest_framework import serializers
-from rest_framework.generics import get_object_or_404
 
-from recipes.models import (AmountIngredient, FavoriteRecipe, Ingredient,
-                            Recipe, ShoppingList, Tag)
-from user.models import CustomUser, Follow
+from recipes import images, shopping_totals
+from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
+from recipes.signals import recipe_ingredients_changed
+from user.models import CustomUser
+
+from . import user_state
+from .metrics import serializer_timer
 
 logger = logging.getLogger()
 
 
+def image_width(request):
+    """Ширина из ?image_size=, если для нее готовятся уменьшенные копии."""
+    width = request and request.query_params.get('image_size')
+    if width and width.isdigit() and int(width) in settings.IMAGE_RENDITIONS:
+        return int(width)
+    return None
+
+
+def image_url(request, name, image_status):
+    """Ссылка на картинку рецепта; с ?image_size=<ширина> - на уменьшенную
+    копию, если она уже готова."""
+    width = image_width(request)
+    if width and image_status == Recipe.IMAGE_READY:
+        name = images.rendition_name(name, width)
+    url = Recipe.image.field.storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
 class Base64ImageField(serializers.ImageField):
-    """Кастомный тип поля для декодирования текст-картинка."""
+    """Кастомный тип поля для декодирования текст-картинка.
+
+    Декодирует base64 кусками во временный файл и проверяет только
+    заголовок картинки: полная проверка, уменьшение и перекодирование
+    выполняются в фоне (recipes.images).
+    """
+    chunk_size = 256 * 1024
+
+    def decode(self, encoded, file):
+        """Декодирует кусками, пропуская пробелы и переводы строк: в
+        каждый кусок идет целое число четверок символов, остаток
+        переносится в следующий."""
+        rest = ''
+        for start in range(0, len(encoded), self.chunk_size):
+            rest += ''.join(encoded[start:start + self.chunk_size].split())
+            aligned = len(rest) - len(rest) % 4
+            file.write(base64.b64decode(rest[:aligned], validate=True))
+            rest = rest[aligned:]
+        if rest:
+            raise binascii.Error('Incorrect padding')
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+            data = TemporaryUploadedFile('temp.' + ext, 'image/' + ext,
+                                         0, None)
+            try:
+                self.decode(imgstr, data)
+            except binascii.Error:
+                self.fail('invalid_image')
+            data.size = data.tell()
+            data.seek(0)
+        file = serializers.FileField.to_internal_value(self, data)
+        try:
+            with Image.open(file):
+                pass
+        except (OSError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        file.seek(0)
+        return file
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return image_url(self.context.get('request'), value.name,
+                         value.instance.image_status)
+
+
+class TimedSerializerMixin:
+    """Время представления идет в Server-Timing и метрики запроса."""
+
+    def to_representation(self, instance):
+        with serializer_timer():
+            return super().to_representation(instance)
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор Пользователя."""
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
@@ -34,11 +110,10 @@ class UserSerializer(serializers.ModelSerializer):
                   'email', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if user.is_authenticated:
-            return Follow.objects.filter(user=user,
-                                         author=obj).exists()
-        return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return user_state.for_request(
+            self.context['request']).is_subscribed(obj.id)
 
     def create(self, validated_data):
         return CustomUser.objects.create_user(
@@ -52,7 +127,7 @@ class UserSerializer(serializers.ModelSerializer):
         return data
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Вспомогательный сериализатор - список рецептов без ингридиентов."""
     image = Base64ImageField(read_only=True)
     name = serializers.ReadOnlyField()
@@ -63,39 +138,23 @@ class RecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class FollowCreateDeleteSerializer(serializers.ModelSerializer):
-    """Подписка и отписка на автора."""
-    email = serializers.ReadOnlyField()
-    username = serializers.ReadOnlyField()
-    first_name = serializers.ReadOnlyField()
-    last_name = serializers.ReadOnlyField()
-    is_subscribed = serializers.SerializerMethodField()
-    recipes = RecipeSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField()
-
-    class Meta:
-        model = CustomUser
-        fields = ('email', 'id', 'username', 'first_name',
-                  'last_name', 'is_subscribed', 'recipes', 'recipes_count')
-
-    def validate(self, obj):
-        if (self.context['request'].user == obj):
-            raise serializers.ValidationError({'errors': 'Ошибка подписки.'})
-        return obj
-
-    def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if user.is_authenticated:
-            return Follow.objects.filter(user=user,
-                                         author=obj).exists()
-        return False
+def get_recipes_limit(request):
+    limit = request.GET.get('recipes_limit')
+    if limit:
+        try:
+            return int(limit)
+        except ValueError:
+            logger.warning('limit должен иметь тип int')
+    return None
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
 
+class SubscribeListSerializer(TimedSerializerMixin,
+                              serializers.ModelSerializer):
+    """Список авторов на которых подписан пользователь.
 
-class SubscribeListSerializer(serializers.ModelSerializer):
-    """Список авторов на которых подписан пользователь."""
+    Использует is_subscribed и latest_recipes автора, если представление
+    подготовило их заранее, см. attach_latest_recipes.
+    """
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
@@ -106,35 +165,83 @@ class SubscribeListSerializer(serializers.ModelSerializer):
                   'last_name', 'is_subscribed', 'recipes', 'recipes_count')
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if user.is_authenticated:
-            return Follow.objects.filter(user=user,
-                                         author=obj).exists()
-        return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return user_state.for_request(
+            self.context['request']).is_subscribed(obj.id)
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            try:
-                recipes = recipes[:int(limit)]
-            except TypeError:
-                logger.warning('limit должен иметь тип int')
-        serializer = RecipeSerializer(recipes, many=True, read_only=True)
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(self.context['request'])
+            if limit is not None:
+                recipes = recipes[:limit]
+        serializer = RecipeSerializer(recipes, many=True, read_only=True,
+                                      context=self.context)
         return serializer.data
 
 
+class FollowCreateDeleteSerializer(SubscribeListSerializer):
+    """Подписка и отписка на автора."""
+    email = serializers.ReadOnlyField()
+    username = serializers.ReadOnlyField()
+    first_name = serializers.ReadOnlyField()
+    last_name = serializers.ReadOnlyField()
+
+    def validate(self, obj):
+        if (self.context['request'].user == obj):
+            raise serializers.ValidationError({'errors': 'Ошибка подписки.'})
+        return obj
+
+
+def attach_latest_recipes(authors, limit):
+    """Загружает последние limit рецептов всех авторов одним запросом
+    с ROW_NUMBER() OVER (PARTITION BY author_id) и кладет их
+    в author.latest_recipes."""
+    authors = list(authors)
+    recipes = Recipe.objects.filter(author__in=authors)
+    if limit is not None:
+        ranked = recipes.annotate(recipe_number=Window(
+            RowNumber(), partition_by=F('author'),
+            order_by=(F('pub_date').desc(), F('id').desc())
+        )).values('id', 'author_id', 'name', 'image', 'image_status',
+                  'cooking_time', 'recipe_number')
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE recipe_number <= %s '
+            f'ORDER BY author_id, recipe_number', (*params, limit))
+    else:
+        recipes = recipes.order_by('author', '-pub_date', '-id')
+    by_author = {author.pk: [] for author in authors}
+    for recipe in recipes:
+        by_author[recipe.author_id].append(recipe)
+    for author in authors:
+        author.latest_recipes = by_author[author.pk]
+    return authors
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массового добавления и удаления."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False,
+        max_length=settings.RECIPE_BATCH_LIMIT)
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
 class PasswordSerializer(serializers.Serializer):
     """Сериализатор смены пароля"""
     new_password = serializers.CharField(required=True)
     current_password = serializers.CharField(required=True)
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор тегов."""
     class Meta:
         model = Tag
@@ -142,7 +249,7 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор Ингредиентов."""
     class Meta:
         model = Ingredient
@@ -150,6 +257,15 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('name', 'measurement_unit')
 
 
+class CookRecipeSerializer(RecipeSerializer):
+    """Рецепт с долей имеющихся ингредиентов и недостающими."""
+    coverage = serializers.FloatField(read_only=True)
+    missing = IngredientSerializer(many=True, read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage', 'missing')
+
+
 class AmountIngredientCreateSerializer(serializers.ModelSerializer):
     """Вспомогательный сериализатор. Ингредиент с количеством для рецепта."""
     id = serializers.IntegerField()
@@ -173,7 +289,7 @@ class AmountIngredientListSerializer(serializers.ModelSerializer):
         read_only_fields = ('amount',)
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Список рецептов."""
     author = UserSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
@@ -190,18 +306,12 @@ class RecipeListSerializer(serializers.ModelSerializer):
                   'name', 'image', 'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
-        user = self.context['request'].user
-        if user.is_authenticated:
-            return FavoriteRecipe.objects.filter(user=user,
-                                                 recipe=obj).exists()
-        return False
+        return user_state.for_request(
+            self.context['request']).is_favorited(obj.id)
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context['request'].user
-        if user.is_authenticated:
-            return ShoppingList.objects.filter(user=user,
-                                               recipe=obj).exists()
-        return False
+        return user_state.for_request(
+            self.context['request']).is_in_shopping_cart(obj.id)
 
 
 class RecipeCreateSerializer(RecipeListSerializer):
@@ -251,27 +361,68 @@ class RecipeCreateSerializer(RecipeListSerializer):
                 'количество игредиента должно быть больше 0')
         return obj
 
+    def save(self, **kwargs):
+        instance = super().save(**kwargs)
+        image = self.validated_data.get('image')
+        if image is not None:
+            image.close()
+        return instance
+
     @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(author=self.context['request'].user,
+                                       image_status=Recipe.IMAGE_PENDING,
                                        **validated_data)
+        images.schedule(recipe)
         recipe.tags.set(tags)
-        results = []
-
-        for ingredient in ingredients:
-            ingredient_obj = get_object_or_404(Ingredient, id=ingredient['id'])
-            amount = ingredient['amount']
-            addition = AmountIngredient(
-                recipe=recipe,
-                ingredient=ingredient_obj,
-                amount=amount
-            )
-            results.append(addition)
-        AmountIngredient.objects.bulk_create(results)
+        AmountIngredient.objects.bulk_create(
+            AmountIngredient(recipe=recipe,
+                             ingredient_id=ingredient['id'],
+                             amount=ingredient['amount'])
+            for ingredient in ingredients
+        )
+        recipe_ingredients_changed.send(
+            sender=Recipe, recipe_id=recipe.id,
+            added=[ingredient['id'] for ingredient in ingredients])
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Сравнивает новые ингредиенты с сохраненными и пишет только
+        разницу: одна вставка, одно обновление и одно удаление."""
+        amounts = {ingredient['id']: ingredient['amount']
+                   for ingredient in ingredients}
+        existing = {amount.ingredient_id: amount for amount in
+                    AmountIngredient.objects.filter(recipe=recipe)}
+        removed = existing.keys() - amounts.keys()
+        created = [
+            AmountIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            current = existing.get(ingredient_id)
+            if current is not None and current.amount != amount:
+                current.amount = amount
+                changed.append(current)
+        if not (removed or created or changed):
+            return
+        shopping_totals.subtract_recipe(recipe)
+        if removed:
+            AmountIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        if changed:
+            AmountIngredient.objects.bulk_update(changed, ('amount',))
+        if created:
+            AmountIngredient.objects.bulk_create(created)
+        shopping_totals.add_recipe(recipe)
+        recipe_ingredients_changed.send(
+            sender=Recipe, recipe_id=recipe.id, removed=list(removed),
+            added=[amount.ingredient_id for amount in created])
+
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
@@ -283,18 +434,22 @@ class RecipeCreateSerializer(RecipeListSerializer):
             'cooking_time',
             instance.cooking_time
         )
-        AmountIngredient.objects.filter(recipe=instance).delete()
-        for ingredient in ingredients:
-            amount = ingredient['amount']
-            AmountIngredient.objects.create(
-                ingredient=get_object_or_404(Ingredient, id=ingredient['id']),
-                recipe=instance, amount=amount
-            )
+        if 'image' in validated_data:
+            instance.image_status = Recipe.IMAGE_PENDING
+        self.update_ingredients(instance, ingredients)
         instance.save()
+        if 'image' in validated_data:
+            images.schedule(instance)
         instance.tags.set(tags)
         return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance], Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch('amountingredients',
+                     queryset=AmountIngredient.objects.select_related(
+                         'ingredient').order_by('id'))
+        )
         return RecipeListSerializer(
             instance, context={"request": self.context.get('request')}
         ).data
@@ -0,0 +1,75 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingList,
+                            Tag)
+from recipes.signals import recipe_image_processed, recipe_ingredients_changed
+from recipes.versions import bump_reference_version
+from user.models import CustomUser, Follow
+
+from . import user_state
+from .authentication import token_cache
+from .cache import bump_page_version
+from .metrics import install_query_counter
+
+connection_created.connect(install_query_counter)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_reference_cache(**kwargs):
+    transaction.on_commit(bump_reference_version)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(recipe_ingredients_changed)
+@receiver(recipe_image_processed)
+def invalidate_page_cache(**kwargs):
+    transaction.on_commit(bump_page_version)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_author_pages(instance, created, update_fields, **kwargs):
+    """Имя и почта автора есть в его рецептах; вход (last_login) и новые
+    пользователи страницы не меняют."""
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    if Recipe.objects.filter(author=instance).exists():
+        transaction.on_commit(bump_page_version)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    # key - первичный ключ, после удаления Django обнуляет его в объекте.
+    keys = [instance.key]
+    transaction.on_commit(lambda: token_cache.delete(keys))
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_tokens(instance, created, update_fields, **kwargs):
+    """Смена пароля, блокировка и правка профиля сбрасывают
+    закешированные токены пользователя; вход (last_login) - нет."""
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    keys = list(Token.objects.filter(user=instance).values_list(
+        'key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: token_cache.delete(keys))
+
+
+@receiver((post_save, post_delete), sender=FavoriteRecipe)
+@receiver((post_save, post_delete), sender=ShoppingList)
+@receiver((post_save, post_delete), sender=Follow)
+def update_user_state(sender, instance, signal, **kwargs):
+    if signal is post_save and not kwargs['created']:
+        return
+    name, field = user_state.TARGETS[sender]
+    transaction.on_commit(lambda: user_state.change(
+        instance.user_id, name, [getattr(instance, field)],
+        signal is post_save))
@@ -0,0 +1,1052 @@
+import asyncio
+import base64
+import os
+import re
+import shutil
+import tempfile
+from io import BytesIO
+from time import monotonic
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import (AsyncRequestFactory, RequestFactory, SimpleTestCase,
+                         TestCase, override_settings)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase, force_authenticate
+
+from recipes import shopping_totals
+from recipes.pantry import pantry_index
+from recipes.search import ingredient_index
+from recipes.models import (AmountIngredient, FavoriteRecipe, FeedEntry,
+                            Ingredient, Recipe, ShoppingList,
+                            ShoppingListTotal, Tag)
+from user.models import CustomUser, Follow
+
+from . import user_state
+from .async_views import as_async_view
+from .authentication import token_cache
+from .cache import bump_page_version
+from .middleware import QueryBudgetMiddleware, ReplicaMiddleware
+from .serializers import Base64ImageField
+from .views import RecipeViewSet, TagViewSet, UserViewSet
+
+MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJ'
+    'AAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+# Все кеши - в памяти процесса: api.user_state читается из базы тремя
+# запросами, а ответы не переходят из других запусков и баз.
+CACHES = {alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                  'LOCATION': f'test-{alias}'}
+          for alias in settings.CACHES}
+
+# Кеш default общий для воркеров, как RedisCache.
+CACHE_DIR = tempfile.mkdtemp()
+SHARED_CACHES = dict(CACHES, default={
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': CACHE_DIR})
+
+
+def create_user(username):
+    return CustomUser.objects.create_user(
+        email=f'{username}@example.com', username=username,
+        first_name=username, last_name=username, password='pass12345!')
+
+
+def create_recipe(author, ingredients=(), **fields):
+    """Рецепт напрямую в базе; ingredients - пары (ингредиент,
+    количество)."""
+    recipe = Recipe.objects.create(
+        author=author, image='recipes/test.png',
+        text=fields.pop('text', 'Описание.'),
+        cooking_time=fields.pop('cooking_time', 10),
+        name=fields.pop('name', 'Рецепт'), **fields)
+    AmountIngredient.objects.bulk_create(
+        AmountIngredient(recipe=recipe, ingredient=ingredient, amount=amount)
+        for ingredient, amount in ingredients)
+    return recipe
+
+
+@override_settings(CACHES=CACHES)
+class CacheTestCase(APITestCase):
+    """Кеши и индексы в памяти процесса пустые в начале каждого теста:
+    TestCase не выполняет on_commit, и сигналы не сдвигают версии
+    справочников и страниц."""
+
+    def setUp(self):
+        super().setUp()
+        for backend in caches.all():
+            backend.clear()
+        ingredient_index.invalidate()
+        pantry_index.invalidate()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeWriteQueriesTest(CacheTestCase):
+    """Число запросов при создании и правке рецепта не зависит от числа
+    ингредиентов. Работа после коммита (поиск, картинка) не считается:
+    TestCase не выполняет on_commit."""
+    CREATE_QUERIES = 16
+    UPDATE_QUERIES = 21
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='pass12345!')
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(40))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, ingredients, amount, **fields):
+        return {
+            'tags': [self.tag.id],
+            'ingredients': [{'id': ingredient.id, 'amount': amount}
+                            for ingredient in ingredients],
+            'name': 'Омлет',
+            'text': 'Взбить и пожарить.',
+            'cooking_time': 10,
+            **fields,
+        }
+
+    def create_recipe(self, count):
+        response = self.client.post(
+            '/api/recipes/',
+            self.payload(self.ingredients[:count], 100, image=IMAGE),
+            format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def test_create_queries(self):
+        for count in (5, 15):
+            with self.subTest(ingredients=count):
+                with self.assertNumQueries(self.CREATE_QUERIES):
+                    self.create_recipe(count)
+
+    def test_partial_update_queries(self):
+        for count in (5, 15):
+            with self.subTest(ingredients=count):
+                recipe_id = self.create_recipe(count)
+                # Первая половина убрана, вторая поменяла количество,
+                # столько же ингредиентов добавлено.
+                ingredients = self.ingredients[count // 2:count // 2 + count]
+                with self.assertNumQueries(self.UPDATE_QUERIES):
+                    response = self.client.patch(
+                        f'/api/recipes/{recipe_id}/',
+                        self.payload(ingredients, 200), format='json')
+                self.assertEqual(response.status_code, 200, response.data)
+                self.assertEqual(
+                    sorted(item['id'] for item in response.data[
+                        'ingredients']),
+                    sorted(ingredient.id for ingredient in ingredients))
+
+
+class RecipeBatchTest(CacheTestCase):
+    """POST и DELETE /api/recipes/favorite/ и /api/recipes/shopping_cart/
+    со списком id."""
+    UNKNOWN = 999999
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('buyer')
+        author = create_user('author')
+        cls.flour, cls.milk = Ingredient.objects.bulk_create((
+            Ingredient(name='Мука', measurement_unit='г'),
+            Ingredient(name='Молоко', measurement_unit='мл'),
+        ))
+        cls.pancakes = create_recipe(
+            author, ((cls.flour, 200), (cls.milk, 300)), name='Блины')
+        cls.bread = create_recipe(author, ((cls.flour, 500),), name='Хлеб')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def send(self, method, url, recipe_ids):
+        response = getattr(self.client, method)(
+            url, {'recipes': recipe_ids}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(item['id'], item['status'])
+                for item in response.data['results']]
+
+    def favorites_count(self, recipe):
+        recipe.refresh_from_db(fields=('favorites_count',))
+        return recipe.favorites_count
+
+    def test_add_unknown_ids(self):
+        for url in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/'):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.send('post', url, [self.UNKNOWN, self.UNKNOWN + 1]),
+                    [(self.UNKNOWN, 404), (self.UNKNOWN + 1, 404)])
+
+    def test_add_mixed_favorites(self):
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.pancakes)
+        results = self.send('post', '/api/recipes/favorite/', [
+            self.pancakes.id, self.bread.id, self.UNKNOWN])
+        self.assertEqual(results, [(self.pancakes.id, 400),
+                                   (self.bread.id, 201), (self.UNKNOWN, 404)])
+        self.assertEqual(self.favorites_count(self.pancakes), 1)
+        self.assertEqual(self.favorites_count(self.bread), 1)
+        self.assertEqual(set(FavoriteRecipe.objects.filter(
+            user=self.user).values_list('recipe_id', flat=True)),
+            {self.pancakes.id, self.bread.id})
+
+    def test_add_mixed_shopping_cart(self):
+        ShoppingList.objects.create(user=self.user, recipe=self.pancakes)
+        results = self.send('post', '/api/recipes/shopping_cart/', [
+            self.bread.id, self.pancakes.id, self.UNKNOWN])
+        self.assertEqual(results, [(self.bread.id, 201),
+                                   (self.pancakes.id, 400),
+                                   (self.UNKNOWN, 404)])
+        self.assertEqual(shopping_totals.mismatches(), [])
+        self.assertEqual(dict(self.user.shopping_totals.values_list(
+            'ingredient_id', 'total_amount')),
+            {self.flour.id: 700, self.milk.id: 300})
+
+    def test_remove_absent(self):
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.pancakes)
+        ShoppingList.objects.create(user=self.user, recipe=self.pancakes)
+        for url in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/'):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.send('delete', url, [self.bread.id, self.UNKNOWN]),
+                    [(self.bread.id, 404), (self.UNKNOWN, 404)])
+                self.assertEqual(
+                    self.send('delete', url, [self.pancakes.id,
+                                              self.bread.id]),
+                    [(self.pancakes.id, 204), (self.bread.id, 404)])
+        self.assertEqual(self.favorites_count(self.pancakes), 0)
+        self.assertFalse(self.user.shopping_totals.exists())
+
+
+class QueryBudgetMiddlewareTest(TestCase):
+    """Параллельные ASGI-запросы идут через одно соединение потока ORM,
+    но считаются раздельно."""
+
+    def queries(self, response):
+        return int(re.search(r'db;desc="(\d+) queries"',
+                             response['Server-Timing']).group(1))
+
+    async def test_overlapping_requests(self):
+        first_started = asyncio.Event()
+        second_done = asyncio.Event()
+
+        async def view(request):
+            request.endpoint = 'test'
+            count = int(request.GET['count'])
+            if request.GET['order'] == 'first':
+                await Tag.objects.acount()
+                first_started.set()
+                await second_done.wait()
+                for _ in range(count - 1):
+                    await Tag.objects.acount()
+            else:
+                await first_started.wait()
+                for _ in range(count):
+                    await Tag.objects.acount()
+                second_done.set()
+            return HttpResponse()
+
+        middleware = QueryBudgetMiddleware(view)
+        factory = RequestFactory()
+        first, second = await asyncio.gather(
+            middleware(factory.get('/', {'order': 'first', 'count': 2})),
+            middleware(factory.get('/', {'order': 'second', 'count': 5})))
+        self.assertEqual(self.queries(first), 2)
+        self.assertEqual(self.queries(second), 5)
+        self.assertIn('serializer;dur=', first['Server-Timing'])
+
+
+class ReferenceCacheTest(CacheTestCase):
+    """Ответ справочника кешируется и сбрасывается после коммита
+    изменения ингредиента."""
+
+    def names(self):
+        response = self.client.get('/api/ingredients/', {'name': 'м'})
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.json()]
+
+    def test_ingredient_change(self):
+        Ingredient.objects.create(name='Мука', measurement_unit='г')
+        self.assertEqual(self.names(), ['Мука'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ['Мука'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Мед', measurement_unit='г')
+        self.assertEqual(self.names(), ['Мед', 'Мука'])
+
+
+class Base64ImageFieldTest(SimpleTestCase):
+    """Декодирование кусками не зависит от пробелов и переводов строк."""
+
+    def field(self):
+        field = Base64ImageField()
+        field.chunk_size = 7
+        return field
+
+    def test_wrapped_base64(self):
+        prefix, encoded = IMAGE.split(',')
+        wrapped = '\n '.join(encoded[start:start + 5]
+                             for start in range(0, len(encoded), 5))
+        file = self.field().run_validation(f'{prefix},{wrapped}')
+        self.assertEqual(file.read(), base64.b64decode(encoded))
+
+    def test_truncated_base64(self):
+        with self.assertRaises(ValidationError):
+            self.field().run_validation(IMAGE[:-3])
+
+
+REPLICA_DIR = tempfile.mkdtemp()
+
+
+# Признак "читать из основной БД" - в общем кеше, как у нескольких
+# воркеров.
+@override_settings(TOKEN_CACHE_TTL=0, CACHES=SHARED_CACHES)
+class ReplicaRoutingTest(CacheTestCase):
+    """Вторая база SQLite - отстающая реплика: в ней нет ни токена,
+    ни подписок пользователя. Подключается после открытия транзакции
+    TestCase, поэтому данные теста в нее не попадают."""
+    REPLICA = 'replica'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        connections.settings[cls.REPLICA] = dict(
+            connections.settings['default'],
+            NAME=os.path.join(REPLICA_DIR, 'replica.sqlite3'))
+        call_command('migrate', database=cls.REPLICA, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[cls.REPLICA].close()
+        del connections[cls.REPLICA]
+        del connections.settings[cls.REPLICA]
+        shutil.rmtree(REPLICA_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.followed, cls.author = create_user('first'), create_user('second')
+        Follow.objects.create(user=cls.user, author=cls.followed)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        super().setUp()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def subscriptions(self):
+        response = self.client.get('/api/users/subscriptions/')
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_reads_from_replica(self):
+        """Токен найден в основной базе, подписки прочитаны из реплики."""
+        self.assertEqual(self.subscriptions(), [])
+
+    def test_sticky_after_write(self):
+        response = self.client.post(
+            f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(self.subscriptions()),
+                         [self.followed.id, self.author.id])
+
+    @override_settings(REPLICA_STICKY_SECONDS=0)
+    def test_sticky_expired(self):
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.subscriptions(), [])
+
+    @override_settings(CACHES=CACHES)
+    def test_warns_without_shared_cache(self):
+        with self.assertLogs('api.middleware', 'WARNING'):
+            ReplicaMiddleware(HttpResponse)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PageCacheTest(CacheTestCase):
+    """Кеш ответов рецептов для анонимов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe = create_recipe(create_user('author'), name='Борщ')
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def get(self, **headers):
+        return self.client.get(self.url, **headers)
+
+    def rename(self, name):
+        """Правка в обход сигналов, как из другого процесса, и сдвиг
+        версии страниц."""
+        Recipe.objects.filter(id=self.recipe.id).update(name=name)
+        bump_page_version()
+
+    def lock_taken(self):
+        """Блокировку построения держит другой запрос."""
+        return mock.patch.object(caches['pages'], 'add', return_value=False)
+
+    def test_hit(self):
+        first = self.get()
+        with self.assertNumQueries(0):
+            second = self.get()
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_stale_while_rebuilding(self):
+        self.get()
+        self.rename('Щи')
+        with self.lock_taken():
+            self.assertEqual(self.get().json()['name'], 'Борщ')
+        self.assertEqual(self.get().json()['name'], 'Щи')
+        self.assertEqual(self.get().json()['name'], 'Щи')
+
+    def test_missing_without_waiting(self):
+        with self.lock_taken(), mock.patch('api.cache.time.sleep') as sleep:
+            self.assertEqual(self.get().json()['name'], 'Борщ')
+        sleep.assert_not_called()
+
+    def test_deleted(self):
+        self.get()
+        self.recipe.delete()
+        bump_page_version()
+        self.assertEqual(self.get().status_code, 404)
+        with self.lock_taken():
+            self.assertEqual(self.get().status_code, 404)
+
+    def test_authenticated_not_cached(self):
+        self.get()
+        self.rename('Щи')
+        self.client.force_authenticate(create_user('reader'))
+        self.assertEqual(self.get().json()['name'], 'Щи')
+
+
+class TokenCacheTest(CacheTestCase):
+    """Кеш токенов в памяти процесса сбрасывается сигналами, а изменения
+    в обход сигналов видны через TOKEN_CACHE_LOCAL_TTL."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('owner')
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': 'pass12345!'})
+        self.key = response.data['auth_token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(self.me(), 200)
+
+    def tearDown(self):
+        token_cache.delete([self.key])
+        super().tearDown()
+
+    def me(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def test_cached(self):
+        hits = token_cache.stats['hits']
+        self.assertEqual(self.me(), 200)
+        self.assertEqual(token_cache.stats['hits'], hits + 1)
+
+    def test_logout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.me(), 401)
+
+    def test_set_password(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/set_password/', {
+                'current_password': 'pass12345!',
+                'new_password': 'new-pass12345!'})
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(token_cache.get(self.key))
+
+    def test_deactivation(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.me(), 401)
+
+    def test_last_login_keeps_tokens(self):
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=('last_login',))
+        self.assertIsNotNone(token_cache.get(self.key))
+
+    def test_revoked_after_ttl(self):
+        """Токен удален в обход сигналов: до истечения TTL запрос
+        проходит по кешу, потом - 401."""
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Token._meta.db_table}')
+        self.assertEqual(self.me(), 200)
+        expired = monotonic() + token_cache.local_ttl() + 1
+        with mock.patch('api.authentication.monotonic',
+                        return_value=expired):
+            self.assertEqual(self.me(), 401)
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class UserStateTest(CacheTestCase):
+    """Версионированная сквозная запись состояния пользователя."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cook')
+        author = create_user('author')
+        cls.soup, cls.salad = (create_recipe(author, name='Суп'),
+                               create_recipe(author, name='Салат'))
+        FavoriteRecipe.objects.create(user=cls.user, recipe=cls.soup)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+    def get(self, queries):
+        with self.assertNumQueries(queries):
+            return user_state.get(self.user.id)
+
+    def add_favorite(self, recipe):
+        """Запись в базу и в кеш, как после коммита."""
+        FavoriteRecipe.objects.create(user=self.user, recipe=recipe)
+        user_state.change(self.user.id, 'favorites', [recipe.id], True)
+
+    def test_cached(self):
+        self.assertTrue(self.get(3).is_favorited(self.soup.id))
+        self.assertTrue(self.get(0).is_favorited(self.soup.id))
+
+    def test_change_one_version_behind(self):
+        self.get(3)
+        self.add_favorite(self.salad)
+        state = self.get(0)
+        self.assertTrue(state.is_favorited(self.salad.id))
+        self.assertEqual(
+            state.version, cache.get(user_state.version_key(self.user.id)))
+
+    def test_change_two_versions_behind(self):
+        """Изменение другого воркера не дошло до записи в кеше: она
+        сбрасывается, а не дополняется."""
+        self.get(3)
+        cache.incr(user_state.version_key(self.user.id))
+        self.add_favorite(self.salad)
+        self.assertIsNone(cache.get(user_state.state_key(self.user.id)))
+        self.assertTrue(self.get(3).is_favorited(self.salad.id))
+
+    def test_change_during_get(self):
+        """Изменение между чтением версии и записью состояния в кеш:
+        записанное состояние уже устарело и не читается."""
+        load = user_state.load
+
+        def load_and_change(user_id):
+            ids = {name: list(values) for name, values in
+                   load(user_id).items()}
+            self.add_favorite(self.salad)
+            return ids
+
+        with mock.patch.object(user_state, 'load', load_and_change):
+            self.assertFalse(
+                user_state.get(self.user.id).is_favorited(self.salad.id))
+        self.assertTrue(self.get(3).is_favorited(self.salad.id))
+
+    def test_version_evicted(self):
+        self.get(3)
+        cache.delete(user_state.version_key(self.user.id))
+        self.assertTrue(self.get(3).is_favorited(self.soup.id))
+        self.get(0)
+
+    def test_change_after_version_evicted(self):
+        self.get(3)
+        cache.delete(user_state.version_key(self.user.id))
+        self.add_favorite(self.salad)
+        self.assertTrue(self.get(3).is_favorited(self.salad.id))
+
+    def test_state_evicted(self):
+        self.get(3)
+        cache.delete(user_state.state_key(self.user.id))
+        self.add_favorite(self.salad)
+        self.assertTrue(self.get(3).is_favorited(self.salad.id))
+
+    @override_settings(CACHES=CACHES)
+    def test_process_cache(self):
+        """С кешем в памяти процесса состояние не хранится между
+        запросами: изменение в другом воркере его бы не сдвинуло."""
+        self.get(3)
+        self.add_favorite(self.salad)
+        self.assertTrue(self.get(3).is_favorited(self.salad.id))
+        self.assertIsNone(cache.get(user_state.state_key(self.user.id)))
+
+
+class RecipeSearchTest(CacheTestCase):
+    """Поиск рецептов: совпадение в названии выше совпадения в
+    ингредиентах, а то - выше совпадения в описании."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        beet = Ingredient.objects.create(name='Свекла', measurement_unit='г')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.by_text = create_recipe(author, name='Винегрет',
+                                        text='Как свекольник, но холодный.')
+            cls.by_name = create_recipe(author, name='Свекольник')
+            cls.other = create_recipe(author, name='Омлет')
+            cls.by_ingredient = create_recipe(author, ((beet, 300),),
+                                              name='Борщ')
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_ranking(self):
+        self.assertEqual(self.search('свек'), [
+            self.by_name.id, self.by_ingredient.id, self.by_text.id])
+
+    def test_ingredient_renamed(self):
+        beet = Ingredient.objects.get(name='Свекла')
+        beet.name = 'Буряк'
+        with self.captureOnCommitCallbacks(execute=True):
+            beet.save()
+        self.assertEqual(self.search('буряк'), [self.by_ingredient.id])
+
+
+@override_settings(FEED_FANOUT_LIMIT=1, FEED_BACKFILL=2)
+class FeedTest(CacheTestCase):
+    """Лента подписок: рецепты раскладываются по лентам подписчиков,
+    кроме рецептов популярных авторов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.author = create_user('author')
+        cls.old_recipes = [create_recipe(cls.author, name=f'Рецепт {number}')
+                           for number in range(3)]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.reader)
+
+    def subscribe(self, author, method='post'):
+        response = getattr(self.client, method)(
+            f'/api/users/{author.id}/subscribe/')
+        self.assertLess(response.status_code, 300)
+
+    def feed(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def entries(self, user):
+        return set(FeedEntry.objects.filter(user=user).values_list(
+            'recipe_id', flat=True))
+
+    def test_follow_backfill(self):
+        self.subscribe(self.author)
+        latest = {recipe.id for recipe in self.old_recipes[-2:]}
+        self.assertEqual(self.entries(self.reader), latest)
+        self.assertEqual(set(self.feed()), latest)
+
+    def test_fanout(self):
+        self.subscribe(self.author)
+        recipe = create_recipe(CustomUser.objects.get(id=self.author.id))
+        self.assertIn(recipe.id, self.entries(self.reader))
+        self.assertEqual(self.feed()[0], recipe.id)
+        self.assertNotIn(recipe.id, self.entries(self.author))
+
+    def test_unfollow(self):
+        self.subscribe(self.author)
+        self.subscribe(self.author, 'delete')
+        self.assertEqual(self.entries(self.reader), set())
+        self.assertEqual(self.feed(), [])
+
+    def test_popular_author(self):
+        """Рецепт автора с подписчиками больше FEED_FANOUT_LIMIT не
+        раскладывается, но виден в ленте."""
+        Follow.objects.create(user=create_user('fan'), author=self.author)
+        self.subscribe(self.author)
+        recipe = create_recipe(CustomUser.objects.get(id=self.author.id))
+        self.assertNotIn(recipe.id, self.entries(self.reader))
+        self.assertEqual(set(self.feed()), {
+            recipe.id, *(old.id for old in self.old_recipes)})
+
+
+class KeysetPaginationTest(CacheTestCase):
+    """?cursor= проходит список по ключу (-pub_date, -id) без пропусков и
+    повторов, в том числе при одинаковых датах."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        author = create_user('author')
+        recipes = [create_recipe(author, name=f'Рецепт {number}')
+                   for number in range(7)]
+        Recipe.objects.filter(id__in=[recipe.id for recipe in recipes[2:5]]
+                              ).update(pub_date=recipes[2].pub_date)
+        cls.expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            page = self.get(url)
+            pages.append([recipe['id'] for recipe in page['results']])
+            url = page[link]
+        return pages
+
+    def test_forward_and_back(self):
+        pages = self.walk('/api/recipes/?cursor=&limit=3', 'next')
+        self.assertEqual(pages, [self.expected[:3], self.expected[3:6],
+                                 self.expected[6:]])
+        last = self.get('/api/recipes/?cursor=&limit=3')
+        last = self.get(self.get(last['next'])['next'])
+        self.assertEqual(self.walk(last['previous'], 'previous'),
+                         [self.expected[3:6], self.expected[:3]])
+
+    def test_count(self):
+        self.assertEqual(self.get('/api/recipes/?cursor=')['count'], 7)
+        self.assertNotIn(
+            'count', self.get('/api/recipes/?cursor=&skip_count=1'))
+
+    def test_new_recipe_does_not_shift_pages(self):
+        first = self.get('/api/recipes/?cursor=&limit=3')
+        create_recipe(self.user)
+        page = self.get(first['next'])
+        self.assertEqual([recipe['id'] for recipe in page['results']],
+                         self.expected[3:6])
+
+    def test_invalid_cursor(self):
+        for cursor in ('xyz', base64.b64encode(b'[false, [1]]').decode(),
+                       base64.b64encode(b'[false, [null, 1]]').decode()):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/api/recipes/?cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+
+
+class CookTest(CacheTestCase):
+    """/api/recipes/cook/ ранжирует рецепты по доле имеющихся
+    ингредиентов и следит за изменениями рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.flour, cls.milk, cls.egg, cls.salt = (
+            Ingredient.objects.bulk_create(
+                Ingredient(name=name, measurement_unit='г')
+                for name in ('мука', 'молоко', 'яйцо', 'соль')))
+        cls.pancakes = create_recipe(
+            cls.author, [(cls.flour, 200), (cls.milk, 300)], name='Блины')
+        cls.omelet = create_recipe(
+            cls.author, [(cls.milk, 100), (cls.egg, 3)], name='Омлет')
+        cls.bread = create_recipe(
+            cls.author, [(cls.flour, 500), (cls.salt, 10), (cls.egg, 1)],
+            name='Хлеб')
+
+    def cook(self, *ingredients, **params):
+        response = self.client.get('/api/recipes/cook/', {
+            'ingredients': ','.join(str(item.id) for item in ingredients),
+            **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(recipe['name'], round(recipe['coverage'], 2),
+                 [item['name'] for item in recipe['missing']])
+                for recipe in response.data]
+
+    def test_ranking(self):
+        self.assertEqual(self.cook(self.flour, self.milk), [
+            ('Блины', 1.0, []),
+            ('Омлет', 0.5, ['яйцо']),
+            ('Хлеб', 0.33, ['соль', 'яйцо']),
+        ])
+        self.assertEqual(self.cook(self.flour, self.milk, limit=1),
+                         [('Блины', 1.0, [])])
+        self.assertEqual(self.cook(self.salt),
+                         [('Хлеб', 0.33, ['мука', 'яйцо'])])
+
+    def test_invalid_params(self):
+        for params in ({'ingredients': '1,x'}, {'limit': 'x'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/recipes/cook/', params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_follows_changes(self):
+        self.cook(self.flour)
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.omelet.id}/',
+                {'ingredients': [{'id': self.egg.id, 'amount': 3},
+                                 {'id': self.flour.id, 'amount': 50}],
+                 'tags': [self.tag.id], 'name': 'Омлет', 'text': 'Взбить.',
+                 'cooking_time': 5}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.cook(self.flour, self.egg), [
+            ('Омлет', 1.0, []),
+            ('Хлеб', 0.67, ['соль']),
+            ('Блины', 0.5, ['молоко']),
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/recipes/{self.omelet.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual([name for name, _, _ in self.cook(self.egg)],
+                         ['Хлеб'])
+
+
+class ShoppingTotalsTest(CacheTestCase):
+    """Таблица итогов списка покупок совпадает с агрегатом по корзинам
+    после добавления, удаления и правки рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.buyer = create_user('buyer')
+        cls.tag = Tag.objects.create(name='Обед', color='#49B64E',
+                                     slug='lunch')
+        cls.flour, cls.milk, cls.egg = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in (('мука', 'г'), ('молоко', 'мл'),
+                               ('яйцо', 'шт')))
+        cls.pancakes = create_recipe(
+            cls.author, [(cls.flour, 200), (cls.milk, 300)], name='Блины')
+        cls.omelet = create_recipe(
+            cls.author, [(cls.milk, 100), (cls.egg, 3)], name='Омлет')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.buyer)
+
+    def cart(self, method, recipe):
+        response = getattr(self.client, method)(
+            f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertIn(response.status_code, (201, 204), response.data)
+
+    def totals(self):
+        self.assertEqual(shopping_totals.mismatches(), [])
+        return dict(ShoppingListTotal.objects.filter(
+            user=self.buyer).values_list('ingredient__name', 'total_amount'))
+
+    def download(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/',
+                                   HTTP_ACCEPT='text/plain')
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return lines[0], sorted(lines[1:])
+
+    def test_cart(self):
+        self.cart('post', self.pancakes)
+        self.cart('post', self.omelet)
+        self.assertEqual(self.totals(),
+                         {'мука': 200, 'молоко': 400, 'яйцо': 3})
+        self.assertEqual(self.download(), ('Cписок покупок:', [
+            'молоко - 400 мл.', 'мука - 200 г.', 'яйцо - 3 шт.']))
+        self.cart('delete', self.pancakes)
+        self.assertEqual(self.totals(), {'молоко': 100, 'яйцо': 3})
+
+    def test_recipe_changes(self):
+        self.cart('post', self.pancakes)
+        self.cart('post', self.omelet)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f'/api/recipes/{self.pancakes.id}/',
+            {'ingredients': [{'id': self.flour.id, 'amount': 250},
+                             {'id': self.egg.id, 'amount': 2}],
+             'tags': [self.tag.id], 'name': 'Блины', 'text': 'Смешать.',
+             'cooking_time': 20}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.totals(),
+                         {'мука': 250, 'молоко': 100, 'яйцо': 5})
+        response = self.client.delete(f'/api/recipes/{self.omelet.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.totals(), {'мука': 250, 'яйцо': 2})
+
+    def test_rebuild(self):
+        self.cart('post', self.pancakes)
+        ShoppingListTotal.objects.filter(ingredient=self.flour).update(
+            total_amount=1)
+        ShoppingListTotal.objects.filter(ingredient=self.milk).delete()
+        self.assertEqual(
+            shopping_totals.mismatches(),
+            sorted([(self.buyer.id, self.flour.id, 200, 1),
+                    (self.buyer.id, self.milk.id, 300, None)]))
+        shopping_totals.rebuild()
+        self.assertEqual(self.totals(), {'мука': 200, 'молоко': 300})
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_WORKERS=0)
+class RecipeImageTest(CacheTestCase):
+    """Картинка рецепта перекодируется после коммита, рядом сохраняются
+    уменьшенные копии, исходник удаляется."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('author')
+        cls.tag = Tag.objects.create(name='Ужин', color='#8775D2',
+                                     slug='dinner')
+        cls.ingredient = Ingredient.objects.create(name='соль',
+                                                   measurement_unit='г')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def create(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 5}],
+                'name': 'Суп', 'text': 'Сварить.', 'cooking_time': 30,
+                'image': image}, format='json')
+        return response
+
+    def test_processed(self):
+        response = self.create(IMAGE)
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_READY)
+        self.assertTrue(recipe.image.name.endswith('.jpg'))
+        storage = recipe.image.storage
+        root = os.path.splitext(recipe.image.name)[0]
+        for width in settings.IMAGE_RENDITIONS:
+            self.assertTrue(storage.exists(f'{root}_{width}.jpg'))
+        self.assertFalse(storage.exists(f'{root}.png'))
+        response = self.client.get(f'/api/recipes/{recipe.id}/',
+                                   {'image_size': 200})
+        self.assertTrue(response.data['image'].endswith(f'{root}_200.jpg'))
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertTrue(response.data['image'].endswith(f'{root}.jpg'))
+
+    def test_not_an_image(self):
+        response = self.create('data:image/png;base64,' + base64.b64encode(
+            b'not an image').decode())
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_truncated_image(self):
+        """Заголовок PNG читается при проверке, а обрыв данных
+        обнаруживается только при обработке."""
+        content = BytesIO()
+        Image.effect_noise((64, 64), 50).save(content, 'PNG')
+        png = content.getvalue()
+        with self.assertLogs('recipes.images', 'WARNING'):
+            response = self.create(
+                'data:image/png;base64,'
+                + base64.b64encode(png[:len(png) // 2]).decode())
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_FAILED)
+        self.assertTrue(recipe.image.storage.exists(recipe.image.name))
+
+
+@override_settings(PAGE_CACHE_TTL=0)
+class AsyncViewsTest(CacheTestCase):
+    """Async-представления отдают то же, что синхронные."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        author = create_user('author')
+        Follow.objects.create(user=cls.user, author=author)
+        tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                 slug='breakfast')
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        for number in range(5):
+            create_recipe(author, [(salt, number + 1)],
+                          name=f'Рецепт {number}').tags.set([tag])
+        cls.recipe = Recipe.objects.order_by('id').first()
+        FavoriteRecipe.objects.create(user=cls.user, recipe=cls.recipe)
+
+    def get(self, viewset, actions, path, user=None, **kwargs):
+        """Ответы async- и синхронного представления на один запрос.
+        async_to_sync выполняет ORM-вызовы представления в потоке теста,
+        где видны данные тестовой транзакции."""
+        request = AsyncRequestFactory().get(path)
+        if user is not None:
+            force_authenticate(request, user)
+        response = async_to_sync(as_async_view(viewset, actions))(
+            request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        self.client.force_authenticate(user)
+        expected = self.client.get(path)
+        return ((response.status_code, response.content),
+                (expected.status_code, expected.content))
+
+    def assertSame(self, viewset, actions, path, user=None, **kwargs):
+        actual, expected = self.get(viewset, actions, path, user, **kwargs)
+        self.assertEqual(actual, expected)
+        return actual
+
+    def test_recipes(self):
+        list_actions = {'get': 'list'}
+        for user in (None, self.user):
+            for path in ('/api/recipes/', '/api/recipes/?limit=2&page=2',
+                         '/api/recipes/?cursor=&limit=2',
+                         '/api/recipes/?is_favorited=1'):
+                with self.subTest(user=user, path=path):
+                    status, _ = self.assertSame(RecipeViewSet, list_actions,
+                                                path, user)
+                    self.assertEqual(status, 200)
+
+    def test_recipe(self):
+        retrieve = {'get': 'retrieve'}
+        status, content = self.assertSame(
+            RecipeViewSet, retrieve, f'/api/recipes/{self.recipe.id}/',
+            self.user, pk=str(self.recipe.id))
+        self.assertEqual(status, 200)
+        self.assertIn(b'"is_favorited":true', content)
+        for pk in ('999999', 'abc'):
+            with self.subTest(pk=pk):
+                actual, _ = self.get(RecipeViewSet, retrieve,
+                                     f'/api/recipes/{pk}/', pk=pk)
+                self.assertEqual(actual[0], 404)
+
+    def test_tags_and_subscriptions(self):
+        self.assertSame(TagViewSet, {'get': 'list'}, '/api/tags/')
+        status, content = self.assertSame(
+            UserViewSet, {'get': 'subscriptions'},
+            '/api/users/subscriptions/?recipes_limit=2', self.user)
+        self.assertEqual(status, 200)
+        self.assertIn(b'"recipes_count":5', content)
@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from .async_views import async_urls
+from .views import (IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet,
+                    metrics)
 
 app_name = 'api'
 
@@ -15,5 +18,7 @@ router_api.register(r'recipes', RecipeViewSet, basename='recipes')
 urlpatterns = [
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
-    path('', include(router_api.urls)),
+    path('metrics', metrics, name='metrics'),
+    path('', include(async_urls(router_api.urls) if settings.ASYNC_READ_VIEWS
+                     else router_api.urls)),
 ]
@@ -0,0 +1,142 @@
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+
+from recipes.models import FavoriteRecipe, ShoppingList
+from user.models import Follow
+
+from .cache import is_shared
+
+SOURCES = {
+    'favorites': (FavoriteRecipe, 'recipe_id'),
+    'cart': (ShoppingList, 'recipe_id'),
+    'follows': (Follow, 'author_id'),
+}
+TARGETS = {model: (name, field) for name, (model, field) in SOURCES.items()}
+
+
+def contains(ids, value):
+    position = bisect_left(ids, value)
+    return position < len(ids) and ids[position] == value
+
+
+class UserState:
+    """Избранное, список покупок и подписки пользователя.
+
+    Хранит отсортированные array('q') с id рецептов и авторов: 8 байт на
+    запись, проверка - двоичный поиск.
+    """
+    __slots__ = ('version', 'favorites', 'cart', 'follows')
+
+    def __init__(self, version=None, **ids):
+        self.version = version
+        for name in SOURCES:
+            setattr(self, name, array('q', sorted(ids.get(name, ()))))
+
+    def __getstate__(self):
+        return self.version, self.favorites, self.cart, self.follows
+
+    def __setstate__(self, state):
+        self.version, self.favorites, self.cart, self.follows = state
+
+    def is_favorited(self, recipe_id):
+        return contains(self.favorites, recipe_id)
+
+    def is_in_shopping_cart(self, recipe_id):
+        return contains(self.cart, recipe_id)
+
+    def is_subscribed(self, author_id):
+        return contains(self.follows, author_id)
+
+    def change(self, name, values, present):
+        ids = getattr(self, name)
+        for value in values:
+            if contains(ids, value) == present:
+                continue
+            if present:
+                insort(ids, value)
+            else:
+                del ids[bisect_left(ids, value)]
+
+
+def shared():
+    return is_shared(caches[DEFAULT_CACHE_ALIAS])
+
+
+def state_key(user_id):
+    return f'user-state:{user_id}'
+
+
+def version_key(user_id):
+    return f'user-state-version:{user_id}'
+
+
+def current_version(user_id):
+    """Номер версии состояния; если ключ вытеснен из кеша, начинается с
+    текущего времени, чтобы не совпасть с версиями старых записей."""
+    cache.add(version_key(user_id), time.time_ns(), timeout=None)
+    return cache.get(version_key(user_id))
+
+
+def load(user_id):
+    """Состояние из базы: по запросу на каждое множество."""
+    return {name: model.objects.filter(user_id=user_id).values_list(
+        field, flat=True) for name, (model, field) in SOURCES.items()}
+
+
+def get(user_id):
+    """Состояние пользователя из кеша или из базы.
+
+    Запись в кеше действительна, только пока ее версия совпадает с
+    версией пользователя: любое изменение сдвигает версию. Между
+    запросами состояние хранится, только если кеш default общий для
+    воркеров: изменение в одном воркере не сдвинуло бы версию в других.
+    """
+    if not shared():
+        return UserState(**load(user_id))
+    cached = cache.get_many([state_key(user_id), version_key(user_id)])
+    state = cached.get(state_key(user_id))
+    if (state is not None and state.version is not None
+            and state.version == cached.get(version_key(user_id))):
+        return state
+    state = UserState(current_version(user_id), **load(user_id))
+    cache.set(state_key(user_id), state, settings.USER_STATE_TTL)
+    return state
+
+
+def for_request(request):
+    """Состояние текущего пользователя, один раз на запрос; у анонима -
+    пустое."""
+    state = getattr(request, '_user_state', None)
+    if state is None:
+        if request.user.is_authenticated:
+            state = get(request.user.pk)
+        else:
+            state = UserState()
+        request._user_state = state
+    return state
+
+
+def change(user_id, name, values, present):
+    """Сквозная запись: сдвигает версию и, если в кеше лежит состояние
+    предыдущей версии, применяет к нему изменение. Иначе (параллельная
+    запись или вытеснение) состояние перечитается из базы."""
+    if not shared():
+        return
+    try:
+        version = cache.incr(version_key(user_id))
+    except ValueError:
+        cache.add(version_key(user_id), time.time_ns(), timeout=None)
+        return
+    state = cache.get(state_key(user_id))
+    if state is None:
+        return
+    if state.version != version - 1:
+        cache.delete(state_key(user_id))
+        return
+    state.change(name, values, present)
+    state.version = version
+    cache.set(state_key(user_id), state, settings.USER_STATE_TTL)
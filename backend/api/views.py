@@ -1,24 +1,42 @@
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import hashers
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db.models import Prefetch, Value
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import permissions, status, viewsets
+from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from recipes import feed as recipe_feed
 from recipes.models import (AmountIngredient, FavoriteRecipe, Ingredient,
                             Recipe, ShoppingList, Tag)
+from recipes.pantry import pantry_index
+from recipes.search import ingredient_index
 from user.models import CustomUser, Follow
 
-from .filters import RecipeFilter
+from . import batch, fast_serializers
+from . import metrics as api_metrics
+from . import user_state
+from .async_views import AsyncReadMixin
+from .cache import PageCacheMixin, ReferenceCacheMixin
+from .exporters import EXPORTERS, shopping_list
+from .filters import IngredientFilter, RecipeFilter
 from .pagination import CustomPaginator
 from .permissons import IsAuthorOrReadOnlyRecipePermission, UserEditPermission
-from .serializers import (FollowCreateDeleteSerializer, IngredientSerializer,
-                          PasswordSerializer, RecipeCreateSerializer,
+from .renderers import CSVRenderer, PlainTextRenderer
+from .serializers import (CookRecipeSerializer, FollowCreateDeleteSerializer,
+                          IngredientSerializer, PasswordSerializer,
+                          RecipeCreateSerializer, RecipeIdsSerializer,
                           RecipeListSerializer, RecipeSerializer,
                           SubscribeListSerializer, TagSerializer,
-                          UserSerializer)
+                          UserSerializer, attach_latest_recipes,
+                          get_recipes_limit)
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -61,6 +79,8 @@ class UserViewSet(viewsets.ModelViewSet):
                 author, data=request.data, context={"request": request})
             serializer.is_valid(raise_exception=True)
             Follow.objects.create(user=request.user, author=author)
+            author.is_subscribed = True
+            attach_latest_recipes([author], get_recipes_limit(request))
             return Response(serializer.data,
                             status=status.HTTP_201_CREATED)
         if request.method == 'DELETE':
@@ -73,61 +93,207 @@ class UserViewSet(viewsets.ModelViewSet):
             permission_classes=(permissions.IsAuthenticated,),
             pagination_class=CustomPaginator)
     def subscriptions(self, request):
-        queryset = CustomUser.objects.filter(author__user=request.user)
-        page = self.paginate_queryset(queryset)
+        page = attach_latest_recipes(
+            self.paginate_queryset(self.get_subscriptions(request.user)),
+            get_recipes_limit(request))
+        serializer = SubscribeListSerializer(page, many=True,
+                                             context={'request': request})
+        return self.get_paginated_response(serializer.data)
+
+    async def asubscriptions(self, request):
+        page = await self.paginator.apaginate_queryset(
+            self.get_subscriptions(request.user), request, view=self)
+        page = await sync_to_async(attach_latest_recipes)(
+            page, get_recipes_limit(request))
         serializer = SubscribeListSerializer(page, many=True,
                                              context={'request': request})
         return self.get_paginated_response(serializer.data)
 
+    @staticmethod
+    def get_subscriptions(user):
+        return CustomUser.objects.filter(
+            author__user=user
+        ).annotate(
+            is_subscribed=Value(True)
+        ).order_by('last_name', 'id')
 
-class TagViewSet(viewsets.ModelViewSet):
+
+class TagViewSet(ReferenceCacheMixin, AsyncReadMixin, viewsets.ModelViewSet):
     """Представление тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, AsyncReadMixin,
+                        viewsets.ModelViewSet):
     """Представление ингредиентов."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
+    filter_backends = (DjangoFilterBackend, )
+    filterset_class = IngredientFilter
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name and settings.INGREDIENT_SEARCH_IN_MEMORY:
+            return Response(ingredient_index.search(
+                name, settings.INGREDIENT_SEARCH_LIMIT))
+        return super().list(request, *args, **kwargs)
 
+    async def alist(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name and settings.INGREDIENT_SEARCH_IN_MEMORY:
+            return Response(await sync_to_async(ingredient_index.search)(
+                name, settings.INGREDIENT_SEARCH_LIMIT))
+        return await super().alist(request, *args, **kwargs)
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(PageCacheMixin, AsyncReadMixin, viewsets.ModelViewSet):
     """Представление рецептов, избранных рецептов, список покупок."""
     queryset = Recipe.objects.all()
     serializer_class = RecipeListSerializer
     permission_classes = (IsAuthorOrReadOnlyRecipePermission,)
-    filter_backends = (DjangoFilterBackend, )
+    pagination_class = CustomPaginator
+    filter_backends = (DjangoFilterBackend, filters.OrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('pub_date', 'favorites_count')
+    page_cache_params = ('tags', 'author', 'page', 'limit', 'ordering',
+                         'image_size', 'is_favorited', 'is_in_shopping_cart')
+
+    def get_queryset(self):
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch('amountingredients',
+                     queryset=AmountIngredient.objects.select_related(
+                         'ingredient').order_by('id'))
+        )
+        return queryset
 
     def get_serializer_class(self):
         if self.action == 'create' or self.action == 'partial_update':
             return RecipeCreateSerializer
         return RecipeListSerializer
 
+    def list(self, request, *args, **kwargs):
+        return self.page_cached_response(self.list_page, request,
+                                         *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.page_cached_response(super().retrieve, request,
+                                         *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.apage_cached_response(self.alist_page, request,
+                                                *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.apage_cached_response(self.aretrieve_page,
+                                                request, *args, **kwargs)
+
+    def list_page(self, request, *args, **kwargs):
+        if not settings.FAST_RECIPE_SERIALIZER:
+            return super().list(request, *args, **kwargs)
+        return self.fast_list(self.filter_queryset(self.get_queryset()))
+
+    async def alist_page(self, request, *args, **kwargs):
+        if not settings.FAST_RECIPE_SERIALIZER:
+            await sync_to_async(user_state.for_request)(request)
+            return await super().alist(request, *args, **kwargs)
+        queryset = await sync_to_async(self.filter_queryset)(
+            self.get_queryset())
+        page = await self.paginator.apaginate_queryset(
+            fast_serializers.recipe_rows(queryset), request, view=self)
+        return self.get_paginated_response(
+            await sync_to_async(fast_serializers.serialize_recipes)(
+                page, request))
+
+    async def aretrieve_page(self, request, *args, **kwargs):
+        await sync_to_async(user_state.for_request)(request)
+        return await super().aretrieve(request, *args, **kwargs)
+
+    def fast_list(self, queryset):
+        """Список рецептов без RecipeListSerializer: строки .values()
+        и словари из fast_serializers, ответ тот же."""
+        page = self.paginate_queryset(fast_serializers.recipe_rows(queryset))
+        return self.get_paginated_response(
+            fast_serializers.serialize_recipes(page, self.request))
+
     @action(['GET'], detail=False,
-            permission_classes=(permissions.IsAuthenticated,))
+            permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer))
     def download_shopping_cart(self, request):
-        ingredients = (
-            AmountIngredient.objects
-            .filter(recipe__shopping_lists__user=request.user)
-            .values('ingredient')
-            .annotate(total_amount=Sum('amount'))
-            .values_list('ingredient__name', 'total_amount',
-                         'ingredient__measurement_unit')
+        renderer = request.accepted_renderer
+        exporter = EXPORTERS[renderer.format]
+        file = StreamingHttpResponse(
+            exporter(shopping_list(request.user)),
+            content_type=f'{renderer.media_type}; charset=utf-8'
         )
-        file_list = []
-        [file_list.append(
-            '{} - {} {}.'.format(*ingredient)) for ingredient in ingredients]
-        file = HttpResponse('Cписок покупок:\n' + '\n'.join(file_list),
-                            content_type='text/plain')
         file['Content-Disposition'] = (
-            'attachment; filename="%s"' % 'shopping_list.txt'
+            'attachment; filename="%s"' % f'shopping_list.{renderer.format}'
         )
         return file
 
+    @action(['GET'], detail=False,
+            permission_classes=(permissions.IsAuthenticated,))
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь."""
+        queryset = self.filter_queryset(
+            self.get_queryset().filter(
+                recipe_feed.recipes_filter(request.user)))
+        if settings.FAST_RECIPE_SERIALIZER:
+            return self.fast_list(queryset)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(['GET'], detail=False, pagination_class=None,
+            filter_backends=())
+    def cook(self, request):
+        """Что приготовить из имеющихся ингредиентов:
+        ?ingredients=1,2,3&limit=50."""
+        ingredients = self.get_ingredient_ids(request)
+        limit = min(self.get_limit(request), settings.PANTRY_SEARCH_LIMIT)
+        ranked = pantry_index.search(ingredients, limit)
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for recipe_id, _ in ranked])
+        missing = defaultdict(list)
+        for amount in AmountIngredient.objects.filter(
+            recipe_id__in=recipes
+        ).exclude(
+            ingredient_id__in=ingredients
+        ).select_related('ingredient').order_by('ingredient__name'):
+            missing[amount.recipe_id].append(amount.ingredient)
+        results = []
+        for recipe_id, coverage in ranked:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.coverage = coverage
+            recipe.missing = missing[recipe_id]
+            results.append(recipe)
+        serializer = CookRecipeSerializer(results, many=True,
+                                          context={'request': request})
+        return Response(serializer.data)
+
+    @staticmethod
+    def get_ingredient_ids(request):
+        try:
+            return {int(value)
+                    for values in request.query_params.getlist('ingredients')
+                    for value in values.split(',') if value.strip()}
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Ожидаются id ингредиентов через запятую.'})
+
+    @staticmethod
+    def get_limit(request):
+        try:
+            return int(request.query_params.get(
+                'limit', settings.PANTRY_SEARCH_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': 'limit должен быть числом.'})
+
     @action(['POST', 'DELETE'], detail=True,
             permission_classes=(permissions.IsAuthenticated,))
     def favorite(self, request, **kwargs):
@@ -172,3 +338,67 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 {'detail': 'Рецепт успешно удален из списка покупок.'},
                 status=status.HTTP_204_NO_CONTENT
             )
+
+    @action(['POST', 'DELETE'], detail=False, url_path='favorite',
+            permission_classes=(permissions.IsAuthenticated,))
+    def favorite_batch(self, request):
+        """Несколько рецептов в избранное или из него: {"recipes": [1, 2]}."""
+        return self.batch_response(request, FavoriteRecipe, (
+            'Рецепт уже в избранном.',
+            'Рецепт успешно удален из избранного.',
+            'Рецепта нет в избранном.',
+        ))
+
+    @action(['POST', 'DELETE'], detail=False, url_path='shopping_cart',
+            permission_classes=(permissions.IsAuthenticated,))
+    def shopping_cart_batch(self, request):
+        """Несколько рецептов в список покупок или из него."""
+        return self.batch_response(request, ShoppingList, (
+            'Рецепт уже в списке покупок.',
+            'Рецепт успешно удален из списка покупок.',
+            'Рецепта нет в списке покупок.',
+        ))
+
+    def batch_response(self, request, model, messages):
+        """Результат по каждому рецепту в порядке запроса, со статусом,
+        который вернул бы запрос на один рецепт."""
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        exists, removed_message, absent = messages
+        if request.method == 'DELETE':
+            removed = set(batch.remove(model, request.user, recipe_ids))
+            return Response({'results': [
+                {'id': recipe_id, 'status': status.HTTP_204_NO_CONTENT,
+                 'detail': removed_message} if recipe_id in removed else
+                {'id': recipe_id, 'status': status.HTTP_404_NOT_FOUND,
+                 'errors': absent}
+                for recipe_id in recipe_ids
+            ]})
+        recipes = Recipe.objects.in_bulk(recipe_ids)
+        added = set(batch.add(model, request.user, list(recipes)))
+        results = []
+        for recipe_id in recipe_ids:
+            if recipe_id not in recipes:
+                results.append({'id': recipe_id,
+                                'status': status.HTTP_404_NOT_FOUND,
+                                'errors': 'Рецепт не найден.'})
+            elif recipe_id not in added:
+                results.append({'id': recipe_id,
+                                'status': status.HTTP_400_BAD_REQUEST,
+                                'errors': exists})
+            else:
+                results.append({'id': recipe_id,
+                                'status': status.HTTP_201_CREATED,
+                                'recipe': RecipeSerializer(
+                                    recipes[recipe_id],
+                                    context={'request': request}).data})
+        return Response({'results': results})
+
+
+def metrics(request):
+    """Метрики процесса в формате Prometheus."""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(api_metrics.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,66 @@
+from threading import Lock
+
+from django.db.backends.postgresql import base
+from psycopg2 import Error, extras
+from psycopg2.pool import ThreadedConnectionPool
+
+pools = {}
+pools_lock = Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с пулом соединений psycopg2 внутри процесса.
+
+    Django закрывает соединение в конце запроса, а пул забирает его
+    себе и отдает следующему запросу без нового подключения к серверу.
+    Размер пула - ключ POOL настроек базы: MIN_SIZE и MAX_SIZE.
+    С CONN_HEALTH_CHECKS соединение из пула проверяется перед выдачей.
+    """
+
+    def get_pool(self, conn_params):
+        with pools_lock:
+            pool = pools.get(self.alias)
+            if pool is None:
+                options = self.settings_dict.get('POOL', {})
+                pool = pools[self.alias] = ThreadedConnectionPool(
+                    options.get('MIN_SIZE', 1), options.get('MAX_SIZE', 10),
+                    **conn_params)
+        return pool
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        connection = pool.getconn()
+        if not self.is_alive(connection):
+            pool.putconn(connection, close=True)
+            connection = pool.getconn()
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        extras.register_default_jsonb(conn_or_curs=connection,
+                                      loads=lambda x: x)
+        return connection
+
+    def is_alive(self, connection):
+        if connection.closed:
+            return False
+        if not self.settings_dict['CONN_HEALTH_CHECKS']:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except Error:
+            return False
+        return True
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                pools[self.alias].putconn(
+                    self.connection, close=bool(self.connection.closed))
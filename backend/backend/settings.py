@@ -56,6 +56,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.QueryBudgetMiddleware',
+    'api.middleware.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -89,9 +91,40 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.getenv('CONN_HEALTH_CHECKS', 'True') == 'True',
+        'POOL': {
+            'MIN_SIZE': int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+            'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+        },
     }
 }
+if DATABASES['default']['ENGINE'] == 'backend.pooled_postgresql':
+    # Соединения держит пул, Django отдает их обратно в конце запроса.
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Реплики только для чтения: DB_REPLICAS=host1:5432,host2 для PostgreSQL
+# или пути к файлам для SQLite. Маршрутизация - api.replicas.
+for number, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = dict(
+        DATABASES['default'], TEST={'MIRROR': 'default'})
+    if 'sqlite3' in (DATABASES['default']['ENGINE'] or ''):
+        DATABASES[f'replica{number}']['NAME'] = replica
+    else:
+        host, _, port = replica.partition(':')
+        DATABASES[f'replica{number}']['HOST'] = host
+        DATABASES[f'replica{number}']['PORT'] = (
+            port or DATABASES['default']['PORT'])
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+REPLICA_READ_VIEWS = (
+    'RecipeViewSet', 'TagViewSet', 'IngredientViewSet',
+    'UserViewSet.subscriptions',
+)
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
 
 
 # Password validation
@@ -140,9 +173,53 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    'reference': {
+        'BACKEND': os.getenv(
+            'REFERENCE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('REFERENCE_CACHE_LOCATION', 'reference'),
+        'TIMEOUT': int(os.getenv('REFERENCE_CACHE_TIMEOUT', 3600)),
+    },
+    'pages': {
+        'BACKEND': os.getenv(
+            'PAGE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('PAGE_CACHE_LOCATION', 'pages'),
+    },
+}
+
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 30))
+PAGE_CACHE_STALE = int(os.getenv('PAGE_CACHE_STALE', 300))
+PAGE_CACHE_LOCK_TIMEOUT = int(os.getenv('PAGE_CACHE_LOCK_TIMEOUT', 10))
+PAGE_CACHE_POLL = 0.05
+
+USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', 600))
+
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_LOCAL_TTL = int(os.getenv('TOKEN_CACHE_LOCAL_TTL', 5))
+if os.getenv('TOKEN_CACHE_BACKEND'):
+    CACHES['tokens'] = {
+        'BACKEND': os.getenv('TOKEN_CACHE_BACKEND'),
+        'LOCATION': os.getenv('TOKEN_CACHE_LOCATION', ''),
+    }
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
@@ -151,3 +228,45 @@ REST_FRAMEWORK = {
 DJOSER = {
     'LOGIN_FIELD': 'email'
 }
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+INGREDIENT_SEARCH_IN_MEMORY = (
+    os.getenv('INGREDIENT_SEARCH_IN_MEMORY', 'True') == 'True'
+)
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', 'russian')
+
+PANTRY_SEARCH_LIMIT = int(os.getenv('PANTRY_SEARCH_LIMIT', 50))
+PANTRY_INDEX_TTL = int(os.getenv('PANTRY_INDEX_TTL', 600))
+
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 10000))
+FEED_BACKFILL = int(os.getenv('FEED_BACKFILL', 100))
+
+RECIPE_BATCH_LIMIT = int(os.getenv('RECIPE_BATCH_LIMIT', 100))
+
+FAST_RECIPE_SERIALIZER = (
+    os.getenv('FAST_RECIPE_SERIALIZER', 'True') == 'True'
+)
+
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_MAX_SIZE = int(os.getenv('IMAGE_MAX_SIZE', 1920))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG')
+IMAGE_RENDITIONS = tuple(
+    int(width) for width in os.getenv('IMAGE_RENDITIONS', '200,600').split(',')
+)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'False') == 'True'
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'
+# +3 запроса у рецептов - загрузка api.user_state, если ее нет в кеше
+# (без общего CACHE_BACKEND - на каждом запросе).
+QUERY_BUDGETS = {
+    'RecipeViewSet.list': 9,
+    'RecipeViewSet.retrieve': 8,
+    'RecipeViewSet.download_shopping_cart': 3,
+    'UserViewSet.subscriptions': 5,
+    'TagViewSet.list': 2,
+    'IngredientViewSet.list': 2,
+}
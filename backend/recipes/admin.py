@@ -10,7 +10,8 @@ class TagAdmin(admin.ModelAdmin):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author')
+    list_display = ('id', 'name', 'author', 'favorites_count',
+                    'image_status')
     list_display_links = ('id',)
     list_filter = ('name', 'author', 'tags')
     list_editable = ('name', 'author')
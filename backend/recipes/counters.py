@@ -0,0 +1,36 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from user.models import CustomUser, Follow
+
+from .models import FavoriteRecipe, Recipe
+
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (CustomUser, 'recipes_count', Recipe, 'author'),
+    (CustomUser, 'followers_count', Follow, 'author'),
+)
+
+
+def change(model, pk, field, delta):
+    """Атомарно меняет счетчик на delta выражением F()."""
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def change_many(model, pks, field, delta):
+    """То же для нескольких объектов одним UPDATE."""
+    model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+def count_of(source, source_field):
+    return Coalesce(Subquery(
+        source.objects.filter(**{source_field: OuterRef('pk')})
+        .order_by().values(source_field)
+        .annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def recount(model, field, source, source_field, start, stop):
+    """Пересчитывает счетчик у объектов с pk в [start, stop)."""
+    return model.objects.filter(pk__gte=start, pk__lt=stop).update(
+        **{field: count_of(source, source_field)})
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from user.models import CustomUser, Follow
+
+from .models import FeedEntry, Recipe
+
+
+def is_popular(author):
+    """Рецепты авторов с большим числом подписчиков не раскладываются
+    по лентам, а читаются из таблицы рецептов при запросе ленты."""
+    return author.followers_count > settings.FEED_FANOUT_LIMIT
+
+
+def push(recipe):
+    """Добавляет новый рецепт в ленты подписчиков автора одним запросом."""
+    if is_popular(recipe.author):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FeedEntry._meta.db_table} (user_id, recipe_id) '
+            f'SELECT user_id, %s FROM {Follow._meta.db_table} '
+            f'WHERE author_id = %s',
+            [recipe.pk, recipe.author_id])
+
+
+def follow(user, author):
+    """Кладет в ленту последние FEED_BACKFILL рецептов нового автора."""
+    if is_popular(author):
+        return
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user.pk, recipe_id=recipe_id)
+         for recipe_id in Recipe.objects.filter(
+             author=author).values_list('id', flat=True)[
+                 :settings.FEED_BACKFILL]),
+        ignore_conflicts=True
+    )
+
+
+def unfollow(user, author):
+    FeedEntry.objects.filter(user=user, recipe__author=author).delete()
+
+
+def recipes_filter(user):
+    """Условие на рецепты ленты: разложенные по ленте и рецепты
+    популярных авторов, на которых подписан пользователь."""
+    return Q(id__in=FeedEntry.objects.filter(
+        user=user).values('recipe_id')) | Q(author__in=Follow.objects.filter(
+            user=user,
+            author__followers_count__gt=settings.FEED_FANOUT_LIMIT
+        ).values('author_id'))
+
+
+def rebuild():
+    """Пересобирает все ленты по подпискам, например после массовой
+    загрузки данных в обход сигналов."""
+    FeedEntry.objects.all().delete()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FeedEntry._meta.db_table} (user_id, recipe_id) '
+            f'SELECT follow.user_id, recipe.id '
+            f'FROM {Follow._meta.db_table} follow '
+            f'JOIN {Recipe._meta.db_table} recipe '
+            f'ON recipe.author_id = follow.author_id '
+            f'JOIN {CustomUser._meta.db_table} author '
+            f'ON author.id = follow.author_id '
+            f'WHERE author.followers_count <= %s',
+            [settings.FEED_FANOUT_LIMIT])
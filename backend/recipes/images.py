@@ -0,0 +1,139 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+from .signals import recipe_image_processed
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+_executor = None
+_executor_lock = Lock()
+_stats_lock = Lock()
+stats = {
+    'scheduled': 0,
+    'processed': 0,
+    'failed': 0,
+    'queue_seconds': 0.0,
+    'processing_seconds': 0.0,
+}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_WORKERS,
+                    thread_name_prefix='recipe-image')
+    return _executor
+
+
+def _count(**values):
+    with _stats_lock:
+        for key, value in values.items():
+            stats[key] += value
+
+
+def schedule(recipe):
+    """Ставит обработку картинки рецепта в очередь после коммита.
+
+    При IMAGE_WORKERS=0 картинка обрабатывается сразу, в потоке запроса.
+    """
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    _count(scheduled=1)
+    if not settings.IMAGE_WORKERS:
+        def process_now():
+            process(recipe_id, image_name, monotonic())
+            recipe.refresh_from_db(fields=('image', 'image_status'))
+        transaction.on_commit(process_now)
+        return
+    transaction.on_commit(lambda: get_executor().submit(
+        _process_in_worker, recipe_id, image_name, monotonic()))
+
+
+def _process_in_worker(recipe_id, image_name, queued_at):
+    try:
+        process(recipe_id, image_name, queued_at)
+    finally:
+        close_old_connections()
+
+
+def rendition_name(name, width):
+    """Имя уменьшенной копии: recipes/temp.jpg -> recipes/temp_200.jpg."""
+    root, ext = os.path.splitext(name)
+    return f'{root}_{width}{ext}'
+
+
+def encode(image):
+    content = BytesIO()
+    image.save(content, settings.IMAGE_FORMAT, quality=85)
+    return ContentFile(content.getvalue())
+
+
+def render(image):
+    """Уменьшает картинку до IMAGE_MAX_SIZE и перекодирует
+    в IMAGE_FORMAT. Возвращает картинку и ее уменьшенные копии
+    по ширинам из IMAGE_RENDITIONS."""
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((settings.IMAGE_MAX_SIZE, settings.IMAGE_MAX_SIZE))
+    if image.mode not in ('RGB', 'RGBA') or settings.IMAGE_FORMAT == 'JPEG':
+        image = image.convert('RGB')
+    renditions = {}
+    for width in settings.IMAGE_RENDITIONS:
+        rendition = image.copy()
+        rendition.thumbnail((width, image.height))
+        renditions[width] = encode(rendition)
+    return encode(image), renditions
+
+
+def save_renditions(storage, name, renditions):
+    for width, content in renditions.items():
+        target = rendition_name(name, width)
+        storage.delete(target)
+        storage.save(target, content)
+
+
+def delete_with_renditions(storage, name):
+    storage.delete(name)
+    for width in settings.IMAGE_RENDITIONS:
+        storage.delete(rendition_name(name, width))
+
+
+def process(recipe_id, image_name, queued_at):
+    started = monotonic()
+    _count(queue_seconds=started - queued_at)
+    recipe = Recipe.objects.filter(pk=recipe_id, image=image_name).first()
+    if recipe is None:
+        return
+    try:
+        with recipe.image.open('rb') as file, Image.open(file) as image:
+            content, renditions = render(image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning('Не удалось обработать картинку %s', image_name)
+        Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+            image_status=Recipe.IMAGE_FAILED)
+        _count(failed=1, processing_seconds=monotonic() - started)
+        return
+    storage = recipe.image.storage
+    name = storage.save('{}.{}'.format(
+        os.path.splitext(image_name)[0],
+        EXTENSIONS[settings.IMAGE_FORMAT]), content)
+    save_renditions(storage, name, renditions)
+    updated = Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+        image=name, image_status=Recipe.IMAGE_READY)
+    if updated:
+        recipe_image_processed.send(sender=Recipe, recipe_id=recipe_id)
+    delete_with_renditions(storage, image_name if updated else name)
+    _count(processed=1, processing_seconds=monotonic() - started)
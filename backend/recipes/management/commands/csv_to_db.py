@@ -1,31 +1,110 @@
 import csv
+import json
 import os
+from io import StringIO
+from itertools import islice
+from time import monotonic
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
 from recipes.models import Ingredient
+from recipes.versions import bump_reference_version
+
+FIELDS = ('name', 'measurement_unit')
+
+
+def read_csv(file):
+    for row in csv.DictReader(file, fieldnames=FIELDS, delimiter=','):
+        yield row['name'], row['measurement_unit']
+
+
+def read_json(file):
+    for row in json.load(file):
+        yield row['name'], row['measurement_unit']
+
+
+def read_json_lines(file):
+    for line in file:
+        if line.strip():
+            row = json.loads(line)
+            yield row['name'], row['measurement_unit']
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+    '.jsonl': read_json_lines,
+}
 
 
 class Command(BaseCommand):
-    help = 'load data from csv'
+    help = 'load ingredients from csv, json or json lines'
 
     def add_arguments(self, parser):
         parser.add_argument('name', type=str, help='Название файла')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько строк записывать за раз')
+
+    def insert(self, batch):
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in batch),
+            ignore_conflicts=True
+        )
+
+    def copy(self, batches):
+        """PostgreSQL: COPY во временную таблицу и одно слияние
+        без дублей."""
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_import '
+                '(name varchar(200), measurement_unit varchar(10)) '
+                'ON COMMIT DROP')
+            for batch in batches:
+                buffer = StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    'COPY ingredient_import (name, measurement_unit) '
+                    'FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING')
+
+    def batches(self, rows, size):
+        rows = iter(rows)
+        batch = list(islice(rows, size))
+        while batch:
+            self.read += len(batch)
+            yield batch
+            batch = list(islice(rows, size))
 
     def handle(self, *args, **options):
         FILENAME = options['name']
         path = os.path.join('data', FILENAME)
-        with open(path, 'r', encoding='utf-8') as csv_file:
-            csv_reader = csv.DictReader(csv_file,
-                                        fieldnames=['name',
-                                                    'measurement_unit'],
-                                        delimiter=',')
-            ingredients = []
-            for row in csv_reader:
-                name = row['name']
-                measurement_unit = row['measurement_unit']
-                ingredient = Ingredient(name=name,
-                                        measurement_unit=measurement_unit)
-                ingredients.append(ingredient)
-            Ingredient.objects.bulk_create(ingredients)
-        self.stdout.write('Таблица с ингредиентами заполнена.')
+        extension = os.path.splitext(FILENAME)[1].lower()
+        if extension not in READERS:
+            raise CommandError('Неизвестный формат {}, поддерживаются: {}.'
+                               .format(extension or FILENAME,
+                                       ', '.join(READERS)))
+        reader = READERS[extension]
+        started = monotonic()
+        before = Ingredient.objects.count()
+        self.read = 0
+        with open(path, 'r', encoding='utf-8') as file, transaction.atomic():
+            batches = self.batches(reader(file), options['batch_size'])
+            if connection.vendor == 'postgresql':
+                self.copy(batches)
+            else:
+                for batch in batches:
+                    self.insert(batch)
+        bump_reference_version()
+        seconds = monotonic() - started
+        self.stdout.write(
+            f'Таблица с ингредиентами заполнена: прочитано {self.read}, '
+            f'добавлено {Ingredient.objects.count() - before}, '
+            f'{self.read / seconds if seconds else 0:.0f} строк в секунду.')
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import FavoriteRecipe, Recipe, ShoppingList, Tag
+from user.models import CustomUser, Follow
+
+
+def unique_index(model, name):
+    """Индекс уникального ограничения: в SQLite он получает
+    автоматическое имя sqlite_autoindex_<таблица>."""
+    return (name, f'sqlite_autoindex_{model._meta.db_table}')
+
+
+class Command(BaseCommand):
+    help = 'show query plans of feed and filter queries and used indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strict', action='store_true',
+                            help='Ошибка, если ожидаемый индекс не выбран')
+
+    def get_queries(self):
+        user = CustomUser.objects.order_by('id').first()
+        tag = Tag.objects.order_by('id').first()
+        if user is None or tag is None:
+            raise CommandError('Нужен хотя бы один пользователь и тег.')
+        return (
+            ('лента рецептов', ('recipe_pub_date_id_idx',),
+             Recipe.objects.order_by('-pub_date', '-id')[:6]),
+            ('рецепты автора', ('recipe_author_pub_date_idx',),
+             Recipe.objects.filter(author=user).order_by('-pub_date')[:6]),
+            ('фильтр по тегу', ('recipe_tags_tag_recipe_idx',),
+             Recipe.objects.filter(tags__slug=tag.slug)[:6]),
+            ('избранное',
+             unique_index(FavoriteRecipe, 'unique_favoriteRecipe_model'),
+             Recipe.objects.filter(favorites__user=user)[:6]),
+            ('список покупок',
+             unique_index(ShoppingList, 'unique_shoppingList_model'),
+             Recipe.objects.filter(shopping_lists__user=user)[:6]),
+            ('подписки', unique_index(Follow, 'unique_follow_model'),
+             CustomUser.objects.filter(author__user=user)[:6]),
+        )
+
+    def handle(self, *args, **options):
+        missing = []
+        for title, indexes, queryset in self.get_queries():
+            plan = queryset.explain()
+            used = any(index.lower() in plan.lower() for index in indexes)
+            status = 'используется' if used else 'НЕ используется'
+            self.stdout.write(f'{title}: {indexes[0]} {status}')
+            self.stdout.write(plan)
+            if not used:
+                missing.append(title)
+        if missing and options['strict']:
+            raise CommandError('Индексы не используются: '
+                               + ', '.join(missing))
@@ -0,0 +1,30 @@
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+
+from recipes import images
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'process pending recipe images and build renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Обработать картинки всех рецептов')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_status=Recipe.IMAGE_PENDING)
+        started = monotonic()
+        count = 0
+        for recipe_id, image_name in recipes.values_list(
+                'id', 'image').iterator():
+            images.process(recipe_id, image_name, monotonic())
+            count += 1
+        seconds = monotonic() - started
+        self.stdout.write(
+            f'Обработано картинок: {count} за {seconds:.1f} с '
+            f'({count / seconds if seconds else 0:.1f} в секунду), '
+            f'ошибок: {images.stats["failed"]}.')
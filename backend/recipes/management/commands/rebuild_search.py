@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from recipes.models import Recipe
+from recipes.search import reindex
+
+
+class Command(BaseCommand):
+    help = 'rebuild full-text search documents of recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Сколько рецептов обновлять за раз')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last = Recipe.objects.aggregate(last=Max('pk'))['last'] or 0
+        updated = sum(reindex(start, start + batch_size)
+                      for start in range(0, last + 1, batch_size))
+        self.stdout.write(f'Поисковый индекс рецептов обновлен: {updated}')
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import shopping_totals
+
+
+class Command(BaseCommand):
+    help = 'rebuild and verify shopping list totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Только проверить, не пересчитывая')
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            with transaction.atomic():
+                shopping_totals.rebuild()
+            self.stdout.write('Сводные списки покупок пересчитаны.')
+        mismatches = shopping_totals.mismatches()
+        for user, ingredient, expected, stored in mismatches:
+            self.stdout.write(
+                f'user={user} ingredient={ingredient}: '
+                f'ожидается {expected}, в таблице {stored}')
+        if mismatches:
+            self.stderr.write(f'Расхождений: {len(mismatches)}.')
+            raise SystemExit(1)
+        self.stdout.write('Расхождений нет.')
@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Max
+
+from recipes.counters import COUNTERS, recount
+
+
+def recount_batch(*args):
+    try:
+        return recount(*args)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'recount favorites, recipes and followers counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Сколько объектов пересчитывать за раз')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Число параллельных потоков')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for model, field, source, source_field in COUNTERS:
+                last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+                updated = sum(executor.map(
+                    lambda start: recount_batch(
+                        model, field, source, source_field,
+                        start, start + batch_size),
+                    range(0, last + 1, batch_size)
+                ))
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}.{field}: '
+                    f'пересчитано {updated}')
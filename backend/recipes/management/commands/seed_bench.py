@@ -0,0 +1,132 @@
+import random
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from recipes import feed, search, shopping_totals
+from recipes.counters import COUNTERS, recount
+from recipes.models import (AmountIngredient, FavoriteRecipe, Ingredient,
+                            Recipe, ShoppingList, Tag)
+from user.models import CustomUser, Follow
+
+BENCH_IMAGE = 'recipes/bench.jpg'
+
+
+class Command(BaseCommand):
+    help = 'generate benchmark data with bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=5)
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Подписок на пользователя')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Избранных рецептов на пользователя')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Рецептов в корзине на пользователя')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def bulk(self, model, objects):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+
+    def sample(self, population, count):
+        return random.sample(population, min(count, len(population)))
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.batch_size = options['batch_size']
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredients:
+            raise CommandError('Сначала загрузите ингредиенты: csv_to_db.')
+        if not default_storage.exists(BENCH_IMAGE):
+            content = BytesIO()
+            Image.new('RGB', (600, 400), '#7fb77e').save(content, 'JPEG')
+            default_storage.save(BENCH_IMAGE, ContentFile(content.getvalue()))
+
+        with transaction.atomic():
+            start = (CustomUser.objects.order_by('-id')
+                     .values_list('id', flat=True).first() or 0) + 1
+            password = make_password('bench-password')
+            self.bulk(CustomUser, (
+                CustomUser(username=f'bench{number}',
+                           email=f'bench{number}@bench.local',
+                           first_name='Bench', last_name=f'User{number}',
+                           password=password)
+                for number in range(start, start + options['users'])
+            ))
+            users = list(CustomUser.objects.filter(
+                username__startswith='bench').values_list('id', flat=True))
+            self.bulk(Tag, (
+                Tag(name=f'bench{number}', slug=f'bench{number}',
+                    color='#{:06X}'.format(random.randrange(0x1000000)))
+                for number in range(options['tags'])
+            ))
+            tags = list(Tag.objects.values_list('id', flat=True))
+
+            first_recipe = (Recipe.objects.order_by('-id')
+                            .values_list('id', flat=True).first() or 0) + 1
+            self.bulk(Recipe, (
+                Recipe(author_id=random.choice(users),
+                       name=f'Рецепт {number}',
+                       text='Описание рецепта для нагрузочного теста.',
+                       cooking_time=random.randint(5, 120),
+                       image=BENCH_IMAGE,
+                       image_status=Recipe.IMAGE_PENDING)
+                for number in range(options['recipes'])
+            ))
+            recipes = list(Recipe.objects.filter(
+                id__gte=first_recipe).values_list('id', flat=True))
+            self.bulk(Recipe.tags.through, (
+                Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+                for recipe in recipes
+                for tag in self.sample(tags, random.randint(1, 3))
+            ))
+            self.bulk(AmountIngredient, (
+                AmountIngredient(recipe_id=recipe, ingredient_id=ingredient,
+                                 amount=random.randint(1, 500))
+                for recipe in recipes
+                for ingredient in self.sample(ingredients,
+                                              random.randint(5, 15))
+            ))
+
+            all_recipes = list(Recipe.objects.values_list('id', flat=True))
+            self.bulk(Follow, (
+                Follow(user_id=user, author_id=author)
+                for user in users
+                for author in self.sample(users, options['follows'])
+                if author != user
+            ))
+            self.bulk(FavoriteRecipe, (
+                FavoriteRecipe(user_id=user, recipe_id=recipe)
+                for user in users
+                for recipe in self.sample(all_recipes, options['favorites'])
+            ))
+            self.bulk(ShoppingList, (
+                ShoppingList(user_id=user, recipe_id=recipe)
+                for user in users
+                for recipe in self.sample(all_recipes, options['cart'])
+            ))
+
+            for model, field, source, source_field in COUNTERS:
+                recount(model, field, source, source_field, 0,
+                        (model.objects.order_by('-id')
+                         .values_list('id', flat=True).first() or 0) + 1)
+            shopping_totals.rebuild()
+            feed.rebuild()
+            search.reindex(0, max(all_recipes, default=0) + 1)
+        self.stdout.write(
+            f'Создано: пользователей {options["users"]}, '
+            f'рецептов {len(recipes)}.')
@@ -0,0 +1,50 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def fill_totals(apps, schema_editor):
+    AmountIngredient = apps.get_model('recipes', 'AmountIngredient')
+    ShoppingListTotal = apps.get_model('recipes', 'ShoppingListTotal')
+    ShoppingListTotal.objects.bulk_create(
+        ShoppingListTotal(user_id=row['recipe__shopping_lists__user'],
+                          ingredient_id=row['ingredient'],
+                          total_amount=row['total_amount'])
+        for row in AmountIngredient.objects
+        .filter(recipe__shopping_lists__isnull=False)
+        .values('recipe__shopping_lists__user', 'ingredient')
+        .annotate(total_amount=Sum('amount'))
+        .order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0005_ingredient_name_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(verbose_name='Общее количество ингредиента')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_totals', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_totals', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Сумма списка покупок',
+                'verbose_name_plural': 'Суммы списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglisttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shoppingListTotal_model'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
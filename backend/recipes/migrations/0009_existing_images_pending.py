@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:31
+
+from django.db import migrations
+
+
+def mark_pending(apps, schema_editor):
+    """У старых картинок нет уменьшенных копий: до запуска
+    process_images они отдаются в исходном размере."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.filter(image_status='ready').update(image_status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_pending, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(source, source_field):
+    return Coalesce(Subquery(
+        source.objects.filter(**{source_field: OuterRef('pk')})
+        .order_by().values(source_field)
+        .annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FavoriteRecipe = apps.get_model('recipes', 'FavoriteRecipe')
+    CustomUser = apps.get_model('user', 'CustomUser')
+    Follow = apps.get_model('user', 'Follow')
+    Recipe.objects.update(favorites_count=count_of(FavoriteRecipe, 'recipe'))
+    CustomUser.objects.update(recipes_count=count_of(Recipe, 'author'),
+                              followers_count=count_of(Follow, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_existing_images_pending'),
+        ('user', '0002_customuser_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
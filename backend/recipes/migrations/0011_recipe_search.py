@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:40
+
+from django.conf import settings
+from django.db import migrations
+
+INGREDIENT_NAMES = (
+    'SELECT i.name FROM recipes_amountingredient a '
+    'JOIN recipes_ingredient i ON i.id = a.ingredient_id '
+    'WHERE a.recipe_id = r.id'
+)
+
+
+def create_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector')
+        config = settings.RECIPE_SEARCH_CONFIG
+        schema_editor.execute(
+            "UPDATE recipes_recipe r SET search_vector = "
+            "setweight(to_tsvector(%s, r.name), 'A') || "
+            "setweight(to_tsvector(%s, coalesce((SELECT "
+            f"string_agg(names.name, ' ') FROM ({INGREDIENT_NAMES}) names), "
+            "'')), 'B') || "
+            "setweight(to_tsvector(%s, r.text), 'C')",
+            [config, config, config])
+        schema_editor.execute(
+            'CREATE INDEX recipe_search_vector_idx ON recipes_recipe '
+            'USING gin (search_vector)')
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5 '
+            "(name, ingredients, text, tokenize='unicode61')")
+        schema_editor.execute(
+            'INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text) '
+            "SELECT r.id, r.name, coalesce((SELECT group_concat(names.name, "
+            f"' ') FROM ({INGREDIENT_NAMES}) names), ''), r.text "
+            'FROM recipes_recipe r')
+
+
+def drop_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+        schema_editor.execute(
+            'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_favorites_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search, drop_search),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_feeds(apps, schema_editor):
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    Follow = apps.get_model('user', 'Follow')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    schema_editor.execute(
+        f'INSERT INTO {FeedEntry._meta.db_table} (user_id, recipe_id) '
+        f'SELECT follow.user_id, recipe.id '
+        f'FROM {Follow._meta.db_table} follow '
+        f'JOIN {Recipe._meta.db_table} recipe '
+        f'ON recipe.author_id = follow.author_id'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0011_recipe_search'),
+        ('user', '0002_customuser_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи лент',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feedEntry_model'),
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
@@ -3,7 +3,7 @@ from colorfield.fields import ColorField
 from django.core.validators import MinValueValidator
 from django.db import models
 
-from user.models import CustomUser
+from user.models import CounterFieldsMixin, CustomUser
 
 
 class Tag(models.Model):
@@ -41,8 +41,17 @@ class Ingredient(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     """Модель рецепта."""
+    IMAGE_PENDING = 'pending'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUSES = (
+        (IMAGE_PENDING, 'Обрабатывается'),
+        (IMAGE_READY, 'Готова'),
+        (IMAGE_FAILED, 'Ошибка обработки'),
+    )
+
     author = models.ForeignKey(CustomUser, verbose_name='Автор',
                                related_name='recipes',
                                on_delete=models.CASCADE)
@@ -54,6 +63,9 @@ class Recipe(models.Model):
                                   verbose_name='Теги')
     image = models.ImageField(verbose_name='Картинка рецепта',
                               upload_to='recipes/')
+    image_status = models.CharField(verbose_name='Статус картинки',
+                                    max_length=10, choices=IMAGE_STATUSES,
+                                    default=IMAGE_READY)
     name = models.CharField(verbose_name='Название рецепта',
                             max_length=200)
     text = models.TextField(verbose_name='Описание рецепта')
@@ -64,11 +76,23 @@ class Recipe(models.Model):
     )
     pub_date = models.DateTimeField(verbose_name='Время публикации',
                                     auto_now_add=True)
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном', default=0, editable=False)
+
+    counter_fields = ('favorites_count',)
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['-favorites_count', '-id'],
+                         name='recipe_favorites_count_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -141,3 +165,49 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return f'У {self.user.username} список покупок для {self.recipe.name}'
+
+
+class ShoppingListTotal(models.Model):
+    """Сводный список покупок: сумма ингредиентов из всех рецептов
+    в корзине пользователя. Поддерживается инкрементально."""
+    user = models.ForeignKey(CustomUser, verbose_name='Пользователь',
+                             related_name='shopping_totals',
+                             on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(Ingredient, verbose_name='Ингредиент',
+                                   related_name='shopping_totals',
+                                   on_delete=models.CASCADE)
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Общее количество ингредиента')
+
+    class Meta:
+        verbose_name = 'Сумма списка покупок'
+        verbose_name_plural = 'Суммы списков покупок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_shoppingListTotal_model'
+        )]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.total_amount} у {self.user}'
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика: записи создаются при публикации
+    рецепта и при подписке на автора."""
+    user = models.ForeignKey(CustomUser, verbose_name='Подписчик',
+                             related_name='feed_entries',
+                             on_delete=models.CASCADE)
+    recipe = models.ForeignKey(Recipe, verbose_name='Рецепт',
+                               related_name='feed_entries',
+                               on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'recipe'],
+            name='unique_feedEntry_model'
+        )]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
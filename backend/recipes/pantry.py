@@ -0,0 +1,185 @@
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import groupby
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+
+from .models import AmountIngredient
+
+
+def to_bitset(recipe_ids):
+    """Множество id рецептов как целое число: бит N - рецепт с id N."""
+    if not recipe_ids:
+        return 0
+    bits = bytearray(max(recipe_ids) // 8 + 1)
+    for recipe_id in recipe_ids:
+        bits[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def add_bitset(planes, bits):
+    """Прибавляет по единице рецептам из bits к битовому счетчику planes
+    (planes[i] - i-й бит числа совпадений каждого рецепта)."""
+    for position, plane in enumerate(planes):
+        planes[position], bits = plane ^ bits, plane & bits
+        if not bits:
+            return
+    planes.append(bits)
+
+
+class PantryIndex:
+    """Обратный индекс "ингредиент -> рецепты" в памяти процесса.
+
+    Редкие ингредиенты хранят отсортированный массив id рецептов, частые -
+    битовое множество; рецепты сгруппированы битовыми множествами по числу
+    ингредиентов. Поиск складывает множества побитово и не перебирает
+    рецепты в Python. Индекс строится лениво, в своем процессе обновляется
+    сигналом recipe_ingredients_changed, в остальных - перестраивается по
+    истечении PANTRY_INDEX_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._postings = None
+        self._sizes = None
+        self._by_size = None
+        self._built_at = 0
+
+    def invalidate(self):
+        self._postings = None
+
+    def _build(self):
+        postings = defaultdict(lambda: array('I'))
+        sizes = array('H')
+        rows = AmountIngredient.objects.order_by(
+            'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id').iterator(chunk_size=10000)
+        for ingredient_id, recipe_id in rows:
+            postings[ingredient_id].append(recipe_id)
+            if recipe_id >= len(sizes):
+                sizes.extend([0] * (recipe_id + 1 - len(sizes)))
+            sizes[recipe_id] += 1
+        dense = len(sizes) // 32
+        postings = {
+            ingredient_id: to_bitset(recipes) if len(recipes) > dense
+            else recipes
+            for ingredient_id, recipes in postings.items()
+        }
+        by_size = defaultdict(lambda: array('I'))
+        for recipe_id, size in enumerate(sizes):
+            if size:
+                by_size[size].append(recipe_id)
+        by_size = {size: to_bitset(recipes)
+                   for size, recipes in by_size.items()}
+        return postings, sizes, by_size
+
+    def _load(self):
+        ttl = getattr(settings, 'PANTRY_INDEX_TTL', 600)
+        index = self._postings, self._sizes, self._by_size
+        if index[0] is not None and monotonic() - self._built_at < ttl:
+            return index
+        with self._lock:
+            index = self._build()
+            self._postings, self._sizes, self._by_size = index
+            self._built_at = monotonic()
+        return index
+
+    def _toggle(self, ingredient_id, recipe_id, present):
+        """Добавляет или убирает рецепт у ингредиента, True - если
+        индекс изменился."""
+        recipes = self._postings.get(ingredient_id, array('I'))
+        if isinstance(recipes, int):
+            bit = 1 << recipe_id
+            if bool(recipes & bit) == present:
+                return False
+            self._postings[ingredient_id] = recipes ^ bit
+            return True
+        position = bisect_left(recipes, recipe_id)
+        found = position < len(recipes) and recipes[position] == recipe_id
+        if found == present:
+            return False
+        if present:
+            recipes.insert(position, recipe_id)
+        else:
+            del recipes[position]
+        self._postings[ingredient_id] = recipes
+        return True
+
+    def change(self, recipe_id, added=(), removed=()):
+        """Добавляет и убирает ингредиенты рецепта в уже построенном
+        индексе."""
+        if self._postings is None:
+            return
+        with self._lock:
+            sizes, by_size = self._sizes, self._by_size
+            if recipe_id >= len(sizes):
+                sizes.extend([0] * (recipe_id + 1 - len(sizes)))
+            size = sizes[recipe_id]
+            size -= sum(self._toggle(ingredient_id, recipe_id, False)
+                        for ingredient_id in removed)
+            size += sum(self._toggle(ingredient_id, recipe_id, True)
+                        for ingredient_id in added)
+            bit = 1 << recipe_id
+            if sizes[recipe_id]:
+                by_size[sizes[recipe_id]] = (
+                    by_size.get(sizes[recipe_id], 0) & ~bit)
+            if size:
+                by_size[size] = by_size.get(size, 0) | bit
+            sizes[recipe_id] = size
+
+    def search(self, ingredient_ids, limit):
+        """Рецепты с наибольшей долей имеющихся ингредиентов.
+
+        Возвращает пары (id рецепта, доля); при равной доле выше рецепты,
+        где не хватает меньшего числа ингредиентов, затем с меньшим id.
+        """
+        postings, _, by_size = self._load()
+        planes = []
+        for ingredient_id in set(ingredient_ids):
+            recipes = postings.get(ingredient_id)
+            if recipes:
+                add_bitset(planes, recipes if isinstance(recipes, int)
+                           else to_bitset(recipes))
+        if not planes:
+            return []
+        matched = 0
+        for plane in planes:
+            matched |= plane
+        exact = {}
+        result = []
+        for (coverage, _), group in groupby(
+            sorted(((hits, size) for hits in range(1, 2 ** len(planes))
+                    for size in by_size if size >= hits), key=self.score),
+            key=self.score
+        ):
+            bits = 0
+            for hits, size in group:
+                if hits not in exact:
+                    exact[hits] = self.exactly(planes, matched, hits)
+                bits |= exact[hits] & by_size[size]
+            while bits and len(result) < limit:
+                lowest = bits & -bits
+                result.append((lowest.bit_length() - 1, -coverage))
+                bits ^= lowest
+            if len(result) >= limit:
+                break
+        return result
+
+    @staticmethod
+    def score(score):
+        hits, size = score
+        return -hits / size, size - hits
+
+    @staticmethod
+    def exactly(planes, matched, hits):
+        """Рецепты, у которых совпало ровно hits ингредиентов."""
+        bits = matched
+        for position, plane in enumerate(planes):
+            bits &= plane if hits >> position & 1 else ~plane
+        return bits
+
+
+pantry_index = PantryIndex()
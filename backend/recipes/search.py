@@ -0,0 +1,189 @@
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import AmountIngredient, Ingredient, Recipe
+from .versions import get_reference_version
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса, отсортированный по названию.
+
+    Строится лениво из таблицы Ingredient и перестраивается, когда
+    меняется версия справочников в общем кеше reference: ее сдвигают
+    сигналы ингредиентов и csv_to_db, в том числе из других процессов.
+    Без общего кеша индекс перестраивается не реже чем раз в
+    INGREDIENT_INDEX_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # (ключи, строки, версия справочников, время построения): одна
+        # ссылка, чтобы читатели без блокировки видели целый индекс.
+        self._index = None
+
+    def invalidate(self):
+        self._index = None
+
+    def _fresh(self, version):
+        """Ключи и строки индекса, если он построен для этой версии и не
+        старше INGREDIENT_INDEX_TTL."""
+        index = self._index
+        ttl = getattr(settings, 'INGREDIENT_INDEX_TTL', 300)
+        if (index is not None and index[2] == version
+                and monotonic() - index[3] < ttl):
+            return index[:2]
+        return None
+
+    def _load(self):
+        version = get_reference_version()
+        fresh = self._fresh(version)
+        if fresh is not None:
+            return fresh
+        with self._lock:
+            # Пока ждали блокировку, индекс мог построить другой поток.
+            fresh = self._fresh(version)
+            if fresh is not None:
+                return fresh
+            rows = sorted(
+                Ingredient.objects.values('id', 'name', 'measurement_unit'),
+                key=lambda row: (row['name'].lower(), row['id'])
+            )
+            keys = [row['name'].lower() for row in rows]
+            self._index = (keys, rows, version, monotonic())
+        return keys, rows
+
+    def search(self, query, limit):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        query = query.lower()
+        keys, rows = self._load()
+        result = []
+        start = position = bisect_left(keys, query)
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(query)):
+            result.append(rows[position])
+            position += 1
+        end = position
+        for position, key in enumerate(keys):
+            if len(result) >= limit:
+                break
+            if start <= position < end:
+                continue
+            if query in key:
+                result.append(rows[position])
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+
+RECIPE_TABLE = Recipe._meta.db_table
+FTS_TABLE = 'recipes_recipe_fts'
+INGREDIENT_NAMES = (
+    f'SELECT i.name FROM {AmountIngredient._meta.db_table} a '
+    f'JOIN {Ingredient._meta.db_table} i ON i.id = a.ingredient_id '
+    f'WHERE a.recipe_id = r.id'
+)
+
+
+def _reindex(where, params):
+    """Обновляет поисковые документы рецептов, подходящих под where;
+    {id} в условии - id рецепта.
+
+    PostgreSQL: колонка search_vector (название - вес A, ингредиенты -
+    B, описание - C). SQLite: строки FTS5-таблицы recipes_recipe_fts.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            config = settings.RECIPE_SEARCH_CONFIG
+            cursor.execute(
+                f'UPDATE {RECIPE_TABLE} r SET search_vector = '
+                f'setweight(to_tsvector(%s, r.name), \'A\') || '
+                f'setweight(to_tsvector(%s, coalesce((SELECT '
+                f'string_agg(names.name, \' \') FROM ({INGREDIENT_NAMES}) '
+                f'names), \'\')), \'B\') || '
+                f'setweight(to_tsvector(%s, r.text), \'C\') '
+                f'WHERE {where.format(id="r.id")}',
+                [config, config, config, *params])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE {where.format(id="rowid")}',
+                params)
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+                f'SELECT r.id, r.name, coalesce((SELECT '
+                f'group_concat(names.name, \' \') FROM ({INGREDIENT_NAMES}) '
+                f'names), \'\'), r.text FROM {RECIPE_TABLE} r '
+                f'WHERE {where.format(id="r.id")}',
+                params)
+        return cursor.rowcount
+
+
+def reindex(start, stop):
+    """Обновляет поисковые документы рецептов с id из [start, stop)."""
+    return _reindex('{id} >= %s AND {id} < %s', [start, stop])
+
+
+def update_recipe(recipe_id):
+    reindex(recipe_id, recipe_id + 1)
+
+
+def update_ingredient_recipes(ingredient_id):
+    """Обновляет документы рецептов с ингредиентом, например после его
+    переименования."""
+    return _reindex(
+        f'{{id}} IN (SELECT recipe_id FROM '
+        f'{AmountIngredient._meta.db_table} WHERE ingredient_id = %s)',
+        [ingredient_id])
+
+
+def remove_recipe(recipe_id):
+    """На PostgreSQL документ удаляется вместе со строкой рецепта."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [recipe_id])
+
+
+def fts_query(query):
+    """Слова запроса в кавычках, последнее - по префиксу: пользовательский
+    ввод не разбирается как синтаксис FTS5."""
+    words = ['"%s"' % word.replace('"', '""') for word in query.split()]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def search_recipes(queryset, query):
+    """Фильтрует рецепты по запросу и добавляет релевантность
+    search_rank: больше - лучше."""
+    if connection.vendor == 'postgresql':
+        tsquery = 'websearch_to_tsquery(%s, %s)'
+        params = [settings.RECIPE_SEARCH_CONFIG, query]
+        condition = RawSQL(f'{RECIPE_TABLE}.search_vector @@ {tsquery}',
+                           params, output_field=BooleanField())
+        rank = RawSQL(f'ts_rank({RECIPE_TABLE}.search_vector, {tsquery})',
+                      params, output_field=FloatField())
+    elif connection.vendor == 'sqlite':
+        query = fts_query(query)
+        if not query:
+            return queryset
+        # Соединение с FTS5-таблицей: rank (bm25 с весами колонок)
+        # считается один раз для каждой найденной строки.
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {RECIPE_TABLE}.id',
+                   f'{FTS_TABLE} MATCH %s',
+                   f"{FTS_TABLE}.rank MATCH 'bm25(10.0, 5.0, 1.0)'"],
+            params=[query],
+            select={'search_rank': f'-{FTS_TABLE}.rank'},
+        ).order_by('-search_rank', '-pub_date')
+    else:
+        return queryset.filter(name__icontains=query)
+    return queryset.filter(condition).annotate(search_rank=rank).order_by(
+        '-search_rank', '-pub_date')
@@ -0,0 +1,110 @@
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery, Sum
+
+from .models import AmountIngredient, ShoppingList, ShoppingListTotal
+
+UPSERT_SQL = (
+    'INSERT INTO {totals} (user_id, ingredient_id, total_amount) '
+    'SELECT cart.user_id, amount.ingredient_id, {aggregate} '
+    'FROM {cart} cart JOIN {amounts} amount '
+    'ON amount.recipe_id = cart.recipe_id '
+    'WHERE {where} {group_by} '
+    'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+    'SET total_amount = {totals}.total_amount + excluded.total_amount'
+)
+
+
+def _upsert(where, params, aggregate=False):
+    sql = UPSERT_SQL.format(
+        totals=ShoppingListTotal._meta.db_table,
+        cart=ShoppingList._meta.db_table,
+        amounts=AmountIngredient._meta.db_table,
+        aggregate='SUM(amount.amount)' if aggregate else 'amount.amount',
+        where=where,
+        group_by=('GROUP BY cart.user_id, amount.ingredient_id'
+                  if aggregate else ''),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def add_recipe(recipe, user=None):
+    """Прибавляет ингредиенты рецепта к спискам покупок одним запросом.
+
+    Без user - ко всем корзинам, в которых лежит рецепт.
+    """
+    if user is None:
+        _upsert('cart.recipe_id = %s', [recipe.pk])
+    else:
+        _upsert('cart.recipe_id = %s AND cart.user_id = %s',
+                [recipe.pk, user.pk])
+
+
+def add_recipes(recipe_ids, user):
+    """Прибавляет ингредиенты нескольких рецептов из корзины пользователя
+    одним запросом."""
+    _upsert('cart.user_id = %s AND cart.recipe_id IN ({})'.format(
+        ', '.join(['%s'] * len(recipe_ids))),
+        [user.pk, *recipe_ids], aggregate=True)
+
+
+def subtract_recipes(recipe_ids, user):
+    """Вычитает ингредиенты нескольких рецептов из списка покупок
+    пользователя."""
+    totals = ShoppingListTotal.objects.filter(
+        user=user, ingredient__amountingredients__recipe__in=recipe_ids)
+    totals.update(total_amount=F('total_amount') - Subquery(
+        AmountIngredient.objects.filter(
+            recipe__in=recipe_ids, ingredient=OuterRef('ingredient')
+        ).order_by().values('ingredient').annotate(
+            total=Sum('amount')).values('total')
+    ))
+    ShoppingListTotal.objects.filter(user=user,
+                                     total_amount__lte=0).delete()
+
+
+def subtract_recipe(recipe, user=None):
+    """Вычитает ингредиенты рецепта из списков покупок."""
+    totals = ShoppingListTotal.objects.filter(
+        ingredient__amountingredients__recipe=recipe)
+    if user is None:
+        totals = totals.filter(user__shopping_lists__recipe=recipe)
+    else:
+        totals = totals.filter(user=user)
+    totals.update(total_amount=F('total_amount') - Subquery(
+        AmountIngredient.objects.filter(
+            recipe=recipe, ingredient=OuterRef('ingredient')
+        ).values('amount')
+    ))
+    totals.filter(total_amount__lte=0).delete()
+
+
+def rebuild():
+    """Пересчитывает таблицу с нуля по корзинам пользователей."""
+    ShoppingListTotal.objects.all().delete()
+    _upsert('1 = 1', [], aggregate=True)
+
+
+def mismatches():
+    """Расхождения таблицы с агрегатом по корзинам:
+    (user_id, ingredient_id, ожидаемое, сохраненное)."""
+    expected = {
+        (row['recipe__shopping_lists__user'], row['ingredient']):
+            row['total_amount']
+        for row in AmountIngredient.objects
+        .filter(recipe__shopping_lists__isnull=False)
+        .values('recipe__shopping_lists__user', 'ingredient')
+        .annotate(total_amount=Sum('amount'))
+        .order_by()
+    }
+    stored = {
+        (user, ingredient): total_amount
+        for user, ingredient, total_amount in ShoppingListTotal.objects
+        .values_list('user', 'ingredient', 'total_amount')
+    }
+    return sorted(
+        (user, ingredient, expected.get((user, ingredient)),
+         stored.get((user, ingredient)))
+        for user, ingredient in expected.keys() | stored.keys()
+        if expected.get((user, ingredient)) != stored.get((user, ingredient))
+    )
@@ -0,0 +1,109 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from user.models import CustomUser, Follow
+
+from . import counters, feed, search, shopping_totals
+from .models import (AmountIngredient, FavoriteRecipe, Ingredient, Recipe,
+                     ShoppingList)
+from .pantry import pantry_index
+
+# Ингредиенты рецепта изменились: recipe_id, added, removed - id
+# добавленных и убранных ингредиентов. Отправляется сериализатором
+# рецепта, bulk-операции сами сигналов не шлют.
+recipe_ingredients_changed = Signal()
+# Картинка рецепта обработана в фоне и переименована: recipe_id. Запись
+# идет через update(), post_save не отправляется.
+recipe_image_processed = Signal()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    search.ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=ShoppingList)
+def add_to_shopping_totals(instance, created, **kwargs):
+    if created:
+        shopping_totals.add_recipe(instance.recipe, instance.user)
+
+
+@receiver(pre_delete, sender=ShoppingList)
+def subtract_from_shopping_totals(instance, **kwargs):
+    shopping_totals.subtract_recipe(instance.recipe, instance.user)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+def increment_favorites_count(instance, created, **kwargs):
+    if created:
+        counters.change(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+def decrement_favorites_count(instance, **kwargs):
+    counters.change(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, **kwargs):
+    if created:
+        counters.change(CustomUser, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    counters.change(CustomUser, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_document(instance, **kwargs):
+    """Документ строится после коммита, когда ингредиенты и теги рецепта
+    уже записаны."""
+    transaction.on_commit(lambda: search.update_recipe(instance.id))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search_documents(instance, created, update_fields,
+                                       **kwargs):
+    if created or (update_fields is not None
+                   and 'name' not in update_fields):
+        return
+    transaction.on_commit(
+        lambda: search.update_ingredient_recipes(instance.id))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_search(instance, **kwargs):
+    search.remove_recipe(instance.id)
+
+
+@receiver(recipe_ingredients_changed)
+def update_pantry_index(recipe_id, added=(), removed=(), **kwargs):
+    transaction.on_commit(
+        lambda: pantry_index.change(recipe_id, added, removed))
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_pantry_index(instance, **kwargs):
+    recipe_ingredients_changed.send(
+        sender=Recipe, recipe_id=instance.id,
+        removed=list(AmountIngredient.objects.filter(
+            recipe=instance).values_list('ingredient_id', flat=True)))
+
+
+@receiver(post_save, sender=Recipe)
+def push_to_feeds(instance, created, **kwargs):
+    if created:
+        feed.push(instance)
+
+
+@receiver(post_save, sender=Follow)
+def fill_feed(instance, created, **kwargs):
+    if created:
+        feed.follow(instance.user, instance.author)
+
+
+@receiver(post_delete, sender=Follow)
+def clear_feed(instance, **kwargs):
+    feed.unfollow(instance.user, instance.author)
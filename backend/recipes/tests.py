@@ -0,0 +1,187 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from user.models import CustomUser, Follow
+
+from .models import AmountIngredient, FavoriteRecipe, Ingredient, Recipe, Tag
+from .pantry import PantryIndex
+from .search import IngredientIndex
+
+
+def create_user(username):
+    return CustomUser.objects.create_user(
+        email=f'{username}@example.com', username=username,
+        first_name=username, last_name=username, password='pass12345!')
+
+
+def create_recipe(author, name='Рецепт'):
+    return Recipe.objects.create(
+        author=author, name=name, image='recipes/test.png',
+        text='Описание.', cooking_time=10)
+
+
+class ExplainQueriesTest(TestCase):
+    """Планы запросов ленты и фильтров выбирают индексы из миграций."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_user('cook')
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+
+    def test_indexes_used(self):
+        output = StringIO()
+        call_command('explain_queries', strict=True, stdout=output)
+        self.assertNotIn('НЕ используется', output.getvalue())
+
+
+class IngredientIndexTest(SimpleTestCase):
+
+    def test_concurrent_misses_build_once(self):
+        index = IngredientIndex()
+        builds = []
+
+        def values(*fields):
+            builds.append(fields)
+            time.sleep(0.05)
+            return [{'id': 1, 'name': 'Соль', 'measurement_unit': 'г'}]
+
+        with mock.patch.object(Ingredient.objects, 'values', values), \
+                ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(
+                lambda query: index.search(query, 10), ['с'] * 4))
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(results, [[{'id': 1, 'name': 'Соль',
+                                     'measurement_unit': 'г'}]] * 4)
+
+
+class PantryIndexTest(TestCase):
+    """Поиск по индексу совпадает с перебором всех рецептов, в том числе
+    после точечных изменений."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.ingredients = [
+            ingredient.id for ingredient in Ingredient.objects.bulk_create(
+                Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+                for number in range(12))]
+        cls.recipes = [create_recipe(author).id for _ in range(80)]
+        generator = random.Random(0)
+        AmountIngredient.objects.bulk_create(
+            AmountIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                             amount=1)
+            for recipe_id in cls.recipes
+            for ingredient_id in generator.sample(
+                cls.ingredients, generator.randint(1, 6)))
+
+    def expected(self, query, limit):
+        recipes = {}
+        for recipe_id, ingredient_id in AmountIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id'):
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        ranked = sorted(
+            (-len(ingredients & query) / len(ingredients),
+             len(ingredients - query), recipe_id)
+            for recipe_id, ingredients in recipes.items()
+            if ingredients & query)
+        return [(recipe_id, -coverage)
+                for coverage, _, recipe_id in ranked[:limit]]
+
+    def assertSearch(self, index):
+        generator = random.Random(1)
+        for size in (1, 2, 3, 5, 12):
+            query = set(generator.sample(self.ingredients, size))
+            with self.subTest(query=query):
+                self.assertEqual(index.search(query, 20),
+                                 self.expected(query, 20))
+
+    def test_search(self):
+        self.assertSearch(PantryIndex())
+
+    def test_change(self):
+        index = PantryIndex()
+        index.search(self.ingredients[:1], 1)
+        generator = random.Random(2)
+        for recipe_id in generator.sample(self.recipes, 20):
+            current = set(AmountIngredient.objects.filter(
+                recipe_id=recipe_id).values_list('ingredient_id', flat=True))
+            removed = set(generator.sample(sorted(current),
+                                           generator.randint(0, len(current))))
+            added = set(generator.sample(self.ingredients, 2)) - current
+            AmountIngredient.objects.filter(
+                recipe_id=recipe_id, ingredient_id__in=removed).delete()
+            AmountIngredient.objects.bulk_create(
+                AmountIngredient(recipe_id=recipe_id, ingredient_id=ingredient,
+                                 amount=1) for ingredient in added)
+            index.change(recipe_id, added, removed)
+        self.assertSearch(index)
+
+    def test_empty_query(self):
+        self.assertEqual(PantryIndex().search([], 10), [])
+        self.assertEqual(PantryIndex().search([0], 10), [])
+
+
+class CountersTest(TestCase):
+    """Счетчики избранного, рецептов и подписчиков."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        cls.recipe = create_recipe(cls.author)
+
+    def counters(self):
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        return (self.recipe.favorites_count, self.author.recipes_count,
+                self.author.followers_count)
+
+    def test_signals(self):
+        self.assertEqual(self.counters(), (0, 1, 0))
+        favorite = FavoriteRecipe.objects.create(user=self.reader,
+                                                 recipe=self.recipe)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        create_recipe(self.author)
+        self.assertEqual(self.counters(), (1, 2, 1))
+        favorite.delete()
+        follow.delete()
+        self.assertEqual(self.counters(), (0, 2, 0))
+
+    def test_save_keeps_counters(self):
+        """Сохранение объекта, загруженного до изменения счетчика, не
+        затирает счетчик."""
+        recipe = Recipe.objects.get(id=self.recipe.id)
+        author = CustomUser.objects.get(id=self.author.id)
+        FavoriteRecipe.objects.create(user=self.reader, recipe=self.recipe)
+        Follow.objects.create(user=self.reader, author=self.author)
+        recipe.name = 'Новое название'
+        recipe.save()
+        author.first_name = 'Новое имя'
+        author.save()
+        self.assertEqual(self.counters(), (1, 1, 1))
+
+
+class RecountTest(TransactionTestCase):
+    """recount пересчитывает счетчики в потоках: данные должны быть
+    закоммичены."""
+
+    def test_recount(self):
+        author, reader = create_user('author'), create_user('reader')
+        recipes = [create_recipe(author) for _ in range(3)]
+        FavoriteRecipe.objects.create(user=reader, recipe=recipes[0])
+        Follow.objects.create(user=reader, author=author)
+        Recipe.objects.update(favorites_count=7)
+        CustomUser.objects.update(recipes_count=7, followers_count=7)
+        call_command('recount', batch_size=2, workers=2, stdout=StringIO())
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True)), [1, 0, 0])
+        self.assertEqual(
+            list(CustomUser.objects.order_by('id').values_list(
+                'recipes_count', 'followers_count')), [(3, 1), (0, 0)])
@@ -0,0 +1,42 @@
+import time
+
+from django.core.cache import caches
+
+REFERENCE_VERSION_KEY = 'reference:version'
+
+
+def get_version(cache, key):
+    """Номер версии; если ключ вытеснен из кеша, начинается с текущего
+    времени, чтобы не совпасть с версиями старых записей."""
+    cache.add(key, time.time_ns(), timeout=None)
+    return cache.get(key)
+
+
+async def aget_version(cache, key):
+    await cache.aadd(key, time.time_ns(), timeout=None)
+    return await cache.aget(key)
+
+
+def bump_version(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def reference_cache():
+    return caches['reference']
+
+
+def get_reference_version():
+    return get_version(reference_cache(), REFERENCE_VERSION_KEY)
+
+
+async def aget_reference_version():
+    return await aget_version(reference_cache(), REFERENCE_VERSION_KEY)
+
+
+def bump_reference_version():
+    """Делает недействительными закешированные ответы справочников и
+    индекс ингредиентов."""
+    bump_version(reference_cache(), REFERENCE_VERSION_KEY)
@@ -4,7 +4,8 @@ from .models import CustomUser, Follow
 
 
 class CustomUserAdmin(admin.ModelAdmin):
-    list_display = ('id', 'username', 'first_name', 'last_name', 'email')
+    list_display = ('id', 'username', 'first_name', 'last_name', 'email',
+                    'recipes_count', 'followers_count')
     list_display_links = ('id',)
     list_filter = ('email', 'first_name')
     list_editable = ('username', 'first_name', 'last_name', 'email')
@@ -2,7 +2,28 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class CustomUser(AbstractUser):
+class CounterFieldsMixin:
+    """Счетчики из counter_fields меняются только выражениями F()
+    (recipes.counters). Обычный save() существующего объекта их не
+    пишет, иначе он затер бы их значениями, прочитанными раньше;
+    записать счетчик можно, только назвав его в update_fields."""
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not args and not self._state.adding
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class CustomUser(CounterFieldsMixin, AbstractUser):
     """Модель кастомного пользователя."""
     username = models.CharField(
         "Логин",
@@ -21,8 +42,13 @@ class CustomUser(AbstractUser):
     last_name = models.CharField("Фамилия", max_length=150)
     email = models.EmailField("Почта", max_length=254, unique=True)
     password = models.CharField("Пароль", max_length=150)
+    recipes_count = models.PositiveIntegerField(
+        "Рецептов", default=0, editable=False)
+    followers_count = models.PositiveIntegerField(
+        "Подписчиков", default=0, editable=False)
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
+    counter_fields = ('recipes_count', 'followers_count')
 
     class Meta:
         verbose_name = "Пользователь"